@@ -2,14 +2,83 @@ import os
 import shutil
 import random
 import json
+import threading
+import time
+import queue
+import sqlite3
+import uuid
+import hashlib
+import io
+import tarfile
+import zipfile
+import argparse
+import sys
+import platform
+import tempfile
+import types
+import heapq
+import importlib
+import importlib.util
+import subprocess
+import re
+from concurrent.futures import Future
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
-import tkinter as tk
-from tkinter import filedialog, ttk
-from tkinterdnd2 import DND_FILES, TkinterDnD
-from PIL import Image, ImageTk, ImageFilter, ImageOps
-import piexif
-import numpy as np
+from PIL import Image, ImageFile
 from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource  # Peak memory for the benchmark suite; not available on Windows
+except ImportError:
+    resource = None
+
+class LazyModule:
+    """
+    Stands in for a module that is slow to import. The import happens on
+    first attribute access, or earlier through load() (e.g. warm-up in the
+    background); it is thread-safe, so any thread may trigger it.
+    """
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def load(self):
+        module = self._lazy_module
+        if module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+                module = self._lazy_module
+        return module
+
+    @property
+    def loaded(self):
+        return self._lazy_module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+# Only needed once images are processed (or for batch/benchmark features), so
+# the review window does not wait for them at startup
+np = LazyModule("numpy")
+piexif = LazyModule("piexif")
+ImageOps = LazyModule("PIL.ImageOps")
+asyncio = LazyModule("asyncio")
+cProfile = LazyModule("cProfile")
+pstats = LazyModule("pstats")
+http_server = LazyModule("http.server")
+
+# --- The GUI is optional: batch processing also runs on headless machines ---
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+    from PIL import ImageTk
+    GUI_IMPORT_ERROR = None
+    _ReviewerBase = tk.Tk
+except ImportError as e:
+    GUI_IMPORT_ERROR = e
+    _ReviewerBase = object
 
 # --- Fallback for different Pillow versions ---
 try:
@@ -18,21 +87,86 @@ try:
 except AttributeError:
     # Older Pillow still uses Image.LANCZOS
     LANCZOS = Image.LANCZOS
+ADAPTIVE_PALETTE = getattr(Image, "Palette", Image).ADAPTIVE
 
 CONFIG_FILE = "config.json"
+# Write-ahead journal of submitted processing jobs, replayed after a crash
+JOURNAL_FILE = "job_journal.jsonl"
+# Content hashes of every source that was kept or modified, across all folders and sessions
+PROCESSED_INDEX_FILE = "processed_sources.db"
+
+# Default values
+DEFAULT_CONFIG = {
+    "use_central_folder": False,
+    "central_folder_path": "",
+    "jpeg_quality": 85,
+    "apply_realism_effects": True,
+    "frame_cache_mb": 1024,
+    "scan_subfolder_depth": 0,
+    "queue_order": "Name",
+    "queue_format_filter": "All formats",
+    "queue_min_megapixels": 0,
+    "output_layout": "flat",
+    "output_shard_size": 1000,
+    "output_sink": "files",
+    "container_max_mb": 2048,
+    "container_max_files": 20000,
+    "write_behind": True,
+    "io_workers": 2,
+    "io_max_pending_mb": 512,
+    "io_fadvise": False,
+    "io_engine": "threads",
+    "io_concurrency": 64,
+    "encoder_profile": "balanced",
+    "target_size_kb": 0,
+    "downscale_to_device": False,
+    "frame_selection": "first",
+    "metrics_file": "",
+    "metrics_prometheus_file": "",
+    "metrics_prometheus_port": 0,
+    "performance_hud": False,
+    "profile_mode": "sampling",
+    "profile_dir": "profiles",
+    "near_duplicate_hashing": True,
+    "near_duplicate_distance": 10,
+    "skip_processed_sources": True,
+    "shared_review": False,
+    "lease_chunks": 64,
+    "lease_seconds": 300,
+    "spool_dir": "",
+}
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".webp"}
+# Folders the reviewer writes into; never scanned as review input
+OUTPUT_SUBFOLDERS = {"keep", "modify", "archive"}
+# Manifest mapping sources to outputs, one per keep/modify folder
+MANIFEST_FILE = "manifest.jsonl"
+# Output layouts: how files are spread over subfolders of keep/, modify/ and archive/
+OUTPUT_LAYOUTS = {
+    "flat": "Flat",
+    "date": "By date",
+    "hash": "By hash prefix",
+    "count": "N files per folder",
+}
+# Output sinks: plain files, or rolling uncompressed tar/zip containers
+OUTPUT_SINKS = {
+    "files": "Files",
+    "tar": "Tar containers",
+    "zip": "Zip containers",
+}
+CONTAINER_INDEX_FILE = "container_index.jsonl"
+# Per-folder database holding the metadata index (and review state)
+FOLDER_DB_NAME = ".image_review.db"
+# Difference hash: DHASH_SIZE x DHASH_SIZE brightness comparisons = 64 bits
+DHASH_SIZE = 8
 
 def load_config():
-    """Loads configuration from a JSON file."""
+    """Loads configuration from a JSON file, filling in defaults for missing keys."""
+    config = dict(DEFAULT_CONFIG)
     if os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    # Default values
-    return {
-        "use_central_folder": False, 
-        "central_folder_path": "",
-        "jpeg_quality": 85,
-        "apply_realism_effects": True,
-    }
+            config.update(json.load(f))
+    return config
 
 def save_config(config):
     """Saves configuration to a JSON file."""
@@ -82,122 +216,3537 @@ def generate_random_gps():
         piexif.GPSIFD.GPSLongitude: to_deg_min_sec(lon),
     }
     
-def apply_realism_effects(img):
+# Which frame of an animated GIF/WebP/multi-page TIFF is processed
+FRAME_SELECTIONS = ("first", "middle", "last")
+
+def select_frame(img, selection="first"):
+    """Seeks a multi-frame image to the frame chosen by `selection`."""
+    n_frames = getattr(img, "n_frames", 1)
+    if n_frames > 1:
+        index = {"first": 0, "middle": n_frames // 2, "last": n_frames - 1}.get(selection, 0)
+        if index != img.tell():
+            img.seek(index)
+    return img
+
+def flatten_alpha(img, background=255):
+    """
+    Composites an RGBA or LA image onto a solid background. A masked paste
+    runs in C and is exact; it measured ~6x faster than the same blend in numpy.
+    """
+    base_mode = img.mode[:-1]
+    flat = Image.new(base_mode, img.size, (background,) * len(base_mode))
+    flat.paste(img, mask=img.getchannel('A'))
+    return flat
+
+def to_rgb(img):
+    """
+    Converts any input mode to 8-bit RGB with the cheapest correct route:
+    - RGB is returned as is (no copy).
+    - Transparent images (RGBA, LA, palette with transparency) are flattened
+      onto white instead of dropping the alpha channel.
+    - 16-bit greyscale is reduced to 8 bits with a right shift. 32-bit 'I'
+      images are shifted only if they are 16-bit PNGs or hold values above
+      255; 8-bit-range values are kept as they are.
+    - Everything else (L, 1, CMYK, YCbCr, plain palettes) uses Pillow's C converter.
+    """
+    mode = img.mode
+    if mode == 'RGB':
+        return img
+    if mode == 'P' and 'transparency' in img.info:
+        img, mode = img.convert('RGBA'), 'RGBA'
+    elif mode == 'PA':
+        img, mode = img.convert('RGBA'), 'RGBA'
+    if mode == 'RGBA':
+        return flatten_alpha(img)
+    if mode == 'LA':
+        return flatten_alpha(img).convert('RGB')
+    if mode.startswith('I;16'):
+        arr = np.asarray(img).astype(np.uint16, copy=False)
+        return Image.fromarray((arr >> 8).astype(np.uint8), 'L').convert('RGB')
+    if mode == 'I':
+        # Older Pillow loads 16-bit PNGs as 32-bit 'I' holding 0..65535
+        arr = np.asarray(img)
+        if img.format == 'PNG' or arr.max(initial=0) > 255:
+            return Image.fromarray((np.clip(arr, 0, 65535) >> 8).astype(np.uint8), 'L').convert('RGB')
+        return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), 'L').convert('RGB')
+    if mode == 'F':
+        return Image.fromarray(np.clip(np.asarray(img), 0, 255).astype(np.uint8), 'L').convert('RGB')
+    return img.convert('RGB')
+
+def ingest_image(img, frame_selection="first"):
+    """Selects the frame to process and converts it to RGB."""
+    return to_rgb(select_frame(img, frame_selection))
+
+# EXIF Orientation values (2-8) and the transpose that displays the image upright
+EXIF_ORIENTATION_TAG = 0x0112
+# Pillow 9.1+ groups the transpose methods in Image.Transpose, older Pillow has them on Image
+_Transpose = getattr(Image, "Transpose", Image)
+ORIENTATION_TRANSPOSES = {
+    2: _Transpose.FLIP_LEFT_RIGHT,
+    3: _Transpose.ROTATE_180,
+    4: _Transpose.FLIP_TOP_BOTTOM,
+    5: _Transpose.TRANSPOSE,
+    6: _Transpose.ROTATE_270,
+    7: _Transpose.TRANSVERSE,
+    8: _Transpose.ROTATE_90,
+}
+
+def get_orientation(img):
+    """Returns the EXIF orientation of `img` (1 if missing or invalid)."""
+    try:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+    return orientation if orientation in ORIENTATION_TRANSPOSES else 1
+
+def orientation_swaps_axes(orientation):
+    """True if displaying upright swaps width and height (orientations 5-8)."""
+    return orientation in (5, 6, 7, 8)
+
+def apply_orientation(img, orientation):
+    """Transposes a PIL image upright. Used where there is no array stage to fold it into."""
+    transpose = ORIENTATION_TRANSPOSES.get(orientation)
+    return img.transpose(transpose) if transpose is not None else img
+
+def orient_array(arr, orientation):
+    """
+    Returns an upright view of an (h, w[, c]) array without copying: flips and
+    rotations are only stride changes, so the next numpy operation writing a
+    new array gets the rotation for free. Matches apply_orientation exactly.
+    """
+    if orientation == 2:
+        return arr[:, ::-1]
+    if orientation == 3:
+        return arr[::-1, ::-1]
+    if orientation == 4:
+        return arr[::-1]
+    if orientation == 5:
+        return arr.swapaxes(0, 1)
+    if orientation == 6:
+        return arr.swapaxes(0, 1)[:, ::-1]
+    if orientation == 7:
+        return arr.swapaxes(0, 1)[::-1, ::-1]
+    if orientation == 8:
+        return arr.swapaxes(0, 1)[::-1]
+    return arr
+
+def open_preview(path, box):
+    """
+    Opens `path` for a preview that fits `box` (width, height, before
+    orientation). JPEGs are decoded at a reduced scale (1/2 to 1/8, never
+    smaller than the box), other formats in full. Returns (img, reduced):
+    only a full-size frame (reduced False) can be reused by a processing job.
+    """
+    img = Image.open(path)
+    full_size = img.size
+    if img.format == "JPEG" and box:
+        if orientation_swaps_axes(get_orientation(img)):
+            box = box[::-1]
+        img.draft(img.mode, box)
+    img.load()
+    return img, img.size != full_size
+
+def benchmark_ingestion(size=(2000, 1500), repeats=3):
+    """
+    Times ingest_image against a plain convert('RGB') for each input type the
+    reviewer accepts. Returns {input type: (ingest ms, convert ms)}.
+    """
+    w, h = size
+    gradient = np.linspace(0, 255, w, dtype=np.float32)[None, :] * np.ones((h, 1), np.float32)
+    rgb = np.stack([gradient, gradient[::-1], np.full_like(gradient, 128)], axis=-1).astype(np.uint8)
+    alpha = (gradient[..., None] > 100).astype(np.uint8) * 255
+    rgb_img = Image.fromarray(rgb, 'RGB')
+    samples = {
+        "RGB JPEG": (rgb_img, "JPEG"),
+        "CMYK JPEG": (rgb_img.convert('CMYK'), "JPEG"),
+        "L JPEG": (rgb_img.convert('L'), "JPEG"),
+        "RGBA PNG": (Image.fromarray(np.concatenate([rgb, alpha], axis=-1), 'RGBA'), "PNG"),
+        "P PNG (transparent)": (rgb_img.convert('P', palette=ADAPTIVE_PALETTE), "PNG"),
+        "16-bit PNG": (Image.fromarray((gradient * 257).astype(np.uint16)), "PNG"),
+        "Animated GIF": ([rgb_img.convert('P', palette=ADAPTIVE_PALETTE)] * 3, "GIF"),
+        "Animated WebP": ([rgb_img] * 3, "WEBP"),
+    }
+    results = {}
+    for name, (sample, fmt) in samples.items():
+        buffer = io.BytesIO()
+        if isinstance(sample, list):
+            sample[0].save(buffer, fmt, save_all=True, append_images=sample[1:], duration=100)
+        else:
+            options = {"transparency": 0} if name.startswith("P PNG") else {}
+            sample.save(buffer, fmt, **options)
+        data = buffer.getvalue()
+        timings = []
+        for route in (lambda img: ingest_image(img, "middle"), lambda img: img.convert('RGB')):
+            best = float("inf")
+            for _ in range(repeats):
+                img = Image.open(io.BytesIO(data))
+                img.load()
+                start = time.perf_counter()
+                route(img)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best * 1000)
+        results[name] = tuple(timings)
+    return results
+
+def apply_realism_effects(img, orientation=1):
     """
     Applies a chain of refined effects based on user feedback.
     - Luminance-dependent noise (more noise in shadows, less in highlights).
     - No more global blur.
     - Subtler chromatic aberration.
+    `orientation` is the EXIF orientation of `img`; the image is turned
+    upright as part of the noise stage, so it costs no extra copy.
+    """
+    # Ensure we are working with an RGB image
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+        
+    # 1. Luminance-Dependent Noise
+    # (rotated while converting to float, so all later math runs on contiguous arrays)
+    np_img = orient_array(np.asarray(img), orientation).astype(np.float32)
+    
+    # Create a grayscale version to determine brightness (0=black, 255=white)
+    luminance = orient_array(np.asarray(img.convert('L')), orientation).astype(np.float32)
+    
+    # Create a "noise mask": Brighter areas get a smaller multiplier, darker areas get a larger one.
+    # We invert luminance (255 - lum) so dark areas have high values.
+    # The strength factor (e.g., / 255.0 * 4.0) controls the max noise intensity.
+    noise_strength_mask = (255.0 - luminance) / 255.0 * 3.5  # Max noise factor of 3.5 in pure black
+    noise_strength_mask = np.expand_dims(noise_strength_mask, axis=-1) # Match shape for broadcasting
+    
+    # Generate standard noise and scale it by our mask
+    noise = np.random.normal(0, 1, np_img.shape)
+    scaled_noise = noise * noise_strength_mask
+
+    # Add the scaled noise to the image and clip to valid range
+    np_img = np.clip(np_img + scaled_noise, 0, 255)
+    img = Image.fromarray(np_img.astype(np.uint8), 'RGB')
+
+
+    # 2. Simulate subtle chromatic aberration with blending for a weaker effect
+    r, g, b = img.split()
+    offset = 1 # Shift by 1 pixel
+
+    # Create empty channels for shifted Red and Blue
+    r_shifted = Image.new('L', img.size)
+    b_shifted = Image.new('L', img.size)
+    
+    # Paste the original channels with an offset
+    r_shifted.paste(r, (-offset, 0))
+    b_shifted.paste(b, (offset, 0))
+
+    # Blend the shifted channels with the originals to make the effect subtle
+    # Reduced alpha from 0.4 to 0.2 for weaker chromatic aberration
+    blend_alpha = 0.2 
+    r_final = Image.blend(r, r_shifted, alpha=blend_alpha)
+    b_final = Image.blend(b, b_shifted, alpha=blend_alpha)
+
+    # Merge the final channels
+    img = Image.merge('RGB', (r_final, g, b_final))
+
+    return img
+
+def benchmark_orientation(size=(4000, 3000), orientation=6, preview_box=(1200, 900), repeats=3):
+    """
+    Times turning a sideways phone JPEG upright the way the reviewer does it
+    against ImageOps.exif_transpose on the full frame. Returns {step: ms}.
+    """
+    w, h = size
+    gradient = np.linspace(0, 255, w, dtype=np.float32)[None, :] * np.ones((h, 1), np.float32)
+    rgb = np.stack([gradient, gradient[::-1], np.full_like(gradient, 128)], axis=-1).astype(np.uint8)
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    Image.fromarray(rgb, 'RGB').save(buffer, "JPEG", quality=90, exif=exif.tobytes())
+    data = buffer.getvalue()
+
+    def preview_folded(img):
+        box = preview_box[::-1] if orientation_swaps_axes(get_orientation(img)) else preview_box
+        thumb = img.copy()
+        thumb.thumbnail(box, LANCZOS)
+        return apply_orientation(thumb, get_orientation(img))
+
+    def preview_transpose(img):
+        thumb = ImageOps.exif_transpose(img)
+        thumb.thumbnail(preview_box, LANCZOS)
+        return thumb
+
+    routes = {
+        "preview, oriented after thumbnail": preview_folded,
+        "preview, exif_transpose first": preview_transpose,
+        # The effects' array stage with and without the rotation folded in;
+        # the rest of the effects costs the same either way
+        "array stage, upright input": lambda img: np.asarray(img).astype(np.float32),
+        "array stage, orientation folded in":
+            lambda img: orient_array(np.asarray(img), get_orientation(img)).astype(np.float32),
+        "full-frame exif_transpose": ImageOps.exif_transpose,
+    }
+    results = {}
+    for name, route in routes.items():
+        best = float("inf")
+        for _ in range(repeats):
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            start = time.perf_counter()
+            route(img)
+            best = min(best, time.perf_counter() - start)
+        results[name] = best * 1000
+    # The decode itself, which the routes above leave out
+    for name, box in (("preview decode, full frame", None), ("preview decode, reduced", preview_box)):
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            open_preview(io.BytesIO(data), box)
+            best = min(best, time.perf_counter() - start)
+        results[name] = best * 1000
+    return results
+
+class FrameCache:
+    """
+    Keeps fully decoded frames in memory so a keep/modify job can reuse the
+    frame the preview already decoded instead of reading the file again.
+    JPEG previews are reduced decodes; their full frame is decoded in the
+    background while the image is shown, and a decision made before that
+    finishes reads the file instead.
+
+    Frames handed to a pending job are pinned and never evicted while the job
+    runs. Unpinned frames are evicted least-recently-used first once the byte
+    budget is exceeded. If pinned frames alone would exceed the budget,
+    `acquire` returns None and the job falls back to decoding from disk.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> [img, nbytes, pins]
+        self._total_bytes = 0
+        self._pinned_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def frame_bytes(img):
+        return img.width * img.height * len(img.getbands())
+
+    def put(self, path, img):
+        nbytes = self.frame_bytes(img)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                return
+            if nbytes > self.max_bytes:
+                return  # Too large to ever fit, the job will decode from disk
+            self._entries[path] = [img, nbytes, 0]
+            self._total_bytes += nbytes
+            self._evict()
+
+    def acquire(self, path):
+        """Returns the cached frame for `path` and pins it, or None."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] == 0:
+                if self._pinned_bytes + entry[1] > self.max_bytes:
+                    self.misses += 1
+                    return None
+                self._pinned_bytes += entry[1]
+            entry[2] += 1
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[0]
+
+    def release(self, path):
+        """Unpins a frame once its job is done. The frame is dropped, since a
+        decided image is not shown again."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            entry[2] -= 1
+            if entry[2] <= 0:
+                self._pinned_bytes -= entry[1]
+                self._total_bytes -= entry[1]
+                del self._entries[path]
+
+    def _evict(self):
+        # Caller holds the lock
+        if self._total_bytes <= self.max_bytes:
+            return
+        for path in list(self._entries):
+            entry = self._entries[path]
+            if entry[2] == 0:
+                self._total_bytes -= entry[1]
+                del self._entries[path]
+                if self._total_bytes <= self.max_bytes:
+                    return
+
+@contextmanager
+def atomic_output(dst_path):
+    """
+    Yields a temporary path next to `dst_path`. On success the temporary file
+    is renamed over `dst_path` in one step, so readers never see a truncated
+    file; on error it is removed.
+    """
+    folder, name = os.path.split(dst_path)
+    tmp_path = os.path.join(folder, f".{name}.{uuid.uuid4().hex[:8]}.part")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def atomic_copy(src_path, dst_path):
+    with atomic_output(dst_path) as tmp_path:
+        shutil.copy2(src_path, tmp_path)
+
+def iter_image_files(folder, max_depth=0, stop_event=None):
+    """
+    Yields image paths in `folder` as they are found, using os.scandir so no
+    full listing is built up front. Subfolders are entered up to `max_depth`
+    levels deep (0 = only the folder itself), skipping our own output folders.
+    """
+    pending = [(folder, 0)]
+    while pending:
+        current, depth = pending.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            if current == folder:
+                raise
+            print(f"Skipping unreadable folder {current}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                try:
+                    if entry.is_file():
+                        if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                            yield entry.path
+                    elif depth < max_depth and entry.name not in OUTPUT_SUBFOLDERS and entry.is_dir(follow_symlinks=False):
+                        pending.append((entry.path, depth + 1))
+                except OSError:
+                    continue  # Entry vanished or is unreadable
+
+class FolderScanner(threading.Thread):
+    """
+    Enumerates a folder in the background and hands found image paths to the
+    UI thread in batches. The first path is published immediately so the
+    first image can be shown before the scan is finished.
+    """
+    BATCH_INTERVAL = 0.1  # seconds
+
+    def __init__(self, folder, max_depth=0):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.max_depth = max_depth
+        self.batches = queue.Queue()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.done = False
+        self.found = 0
+
+    def run(self):
+        batch = []
+        last_flush = 0.0  # Forces the first path out immediately
+        try:
+            for path in iter_image_files(self.folder, self.max_depth, self.stop_event):
+                batch.append(path)
+                self.found += 1
+                now = time.monotonic()
+                if now - last_flush >= self.BATCH_INTERVAL:
+                    self.batches.put(batch)
+                    batch = []
+                    last_flush = now
+        except OSError as e:
+            self.error = e
+        finally:
+            if batch:
+                self.batches.put(batch)
+            self.done = True
+
+    def stop(self):
+        self.stop_event.set()
+
+    def drain(self):
+        """Returns all paths published so far (called from the UI thread)."""
+        paths = []
+        while True:
+            try:
+                paths.extend(self.batches.get_nowait())
+            except queue.Empty:
+                return paths
+
+def read_image_header(path):
+    """
+    Reads basic image properties from the file header only; no pixel data is
+    decoded. Returns a dict matching the columns of the `images` table.
+    """
+    st = os.stat(path)
+    with Image.open(path) as img:
+        width, height = img.size
+        mode, fmt = img.mode, img.format
+        exif = img.getexif()
+        orientation = exif.get(0x0112, 1)  # Orientation
+        # DateTimeOriginal from the Exif IFD, falling back to DateTime
+        captured = exif.get_ifd(0x8769).get(0x9003) or exif.get(0x0132)
+    if isinstance(captured, bytes):
+        captured = captured.decode("ascii", "replace")
+    return {
+        "width": width, "height": height, "mode": mode, "format": fmt,
+        "orientation": int(orientation) if isinstance(orientation, int) else 1,
+        "captured": captured.strip("\x00 ") if captured else None,
+        "file_size": st.st_size, "mtime": st.st_mtime,
+    }
+
+def dhash(path, size=DHASH_SIZE):
+    """
+    Difference hash: the image is shrunk to (size + 1) x size grey pixels and
+    each bit records whether a pixel is brighter than its right neighbour.
+    Near-identical images (burst shots, re-renders, re-encodes) differ in only
+    a few bits. JPEGs are decoded at reduced scale via draft(), so this costs
+    a fraction of a full decode.
+    """
+    with Image.open(path) as img:
+        orientation = get_orientation(img)
+        img.draft("L", (size * 8, size * 8))
+        # Shrink to the pre-rotation shape, so the upright thumbnail is (size + 1) x size
+        box = (size, size + 1) if orientation_swaps_axes(orientation) else (size + 1, size)
+        small = img.resize(box, LANCZOS, reducing_gap=2.0).convert("L")
+    pixels = apply_orientation(small, orientation).tobytes()
+    value = 0
+    for row in range(size):
+        line = pixels[row * (size + 1):(row + 1) * (size + 1)]
+        for left, right in zip(line, line[1:]):
+            value = (value << 1) | (left > right)
+    return value
+
+def read_image_hash(path):
+    """Returns the difference hash of `path` as a dict matching the columns of the `hashes` table."""
+    st = os.stat(path)
+    return {"dhash": format(dhash(path), "016x"), "file_size": st.st_size, "mtime": st.st_mtime}
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with the Hamming distance. A
+    radius query only descends into children whose edge distance can still be
+    within the radius (triangle inequality), so it touches a small part of the
+    tree instead of comparing against every hash.
+    """
+    def __init__(self):
+        self._root = None  # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def remove(self, value, item):
+        """Removes `item` stored under `value`. The node stays in place (it may have children), only emptied."""
+        node = self._root
+        while node is not None:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                if item in node[1]:
+                    node[1].remove(item)
+                    self.size -= 1
+                return
+            node = node[2].get(distance)
+
+    def search(self, value, radius):
+        """Returns [(distance, item)] for every item whose hash is within `radius` of `value`."""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            stack.extend(child for edge, child in node[2].items() if abs(edge - distance) <= radius)
+        return found
+
+def cluster_near_duplicates(hashes, max_distance):
+    """
+    Groups {path: hash} into clusters of near-duplicates. Paths are visited in
+    name order; each path not yet assigned starts a cluster with every
+    unassigned path within `max_distance` of it. Returns only clusters with
+    more than one member.
+    """
+    tree = BKTree()
+    for path, value in hashes.items():
+        tree.add(value, path)
+    assigned = set()
+    clusters = []
+    for path in sorted(hashes):
+        if path in assigned:
+            continue
+        members = sorted(p for _, p in tree.search(hashes[path], max_distance) if p not in assigned)
+        assigned.update(members)
+        if len(members) > 1:
+            clusters.append(members)
+    return clusters
+
+class FolderIndex:
+    """
+    SQLite index of image header metadata (and perceptual hashes) for one
+    folder, stored inside the folder itself. Rows are keyed by the path
+    relative to the folder and are only re-read when a file's mtime or size
+    changes.
+    """
+    COLUMNS = ("width", "height", "mode", "format", "orientation", "captured", "file_size", "mtime")
+    HASH_COLUMNS = ("dhash", "file_size", "mtime")
+    COMMIT_EVERY = 500
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.db_path = os.path.join(folder, FOLDER_DB_NAME)
+        self._lock = threading.Lock()
+        # No WAL: review folders may live on network shares
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "path TEXT PRIMARY KEY, width INTEGER, height INTEGER, mode TEXT, format TEXT, "
+                "orientation INTEGER, captured TEXT, file_size INTEGER, mtime REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, dhash TEXT, file_size INTEGER, mtime REAL)"
+            )
+        # Table name -> (columns, function reading one file's row)
+        self._tables = {
+            "images": (self.COLUMNS, read_image_header),
+            "hashes": (self.HASH_COLUMNS, read_image_hash),
+        }
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.folder).replace(os.sep, "/")
+
+    def abspath(self, rel):
+        return os.path.join(self.folder, *rel.split("/"))
+
+    def load_rows(self):
+        """Returns {absolute path: row dict} for every indexed file."""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT path, {', '.join(self.COLUMNS)} FROM images")
+            return {self.abspath(row[0]): dict(zip(self.COLUMNS, row[1:])) for row in cursor}
+
+    def load_hashes(self):
+        """Returns {absolute path: difference hash} for every hashed file."""
+        with self._lock:
+            return {self.abspath(rel): int(value, 16) for rel, value in
+                    self._conn.execute("SELECT path, dhash FROM hashes")}
+
+    def update(self, paths, stop_event=None, table="images", on_write=None):
+        """
+        Indexes new or changed files among `paths`. Returns the number of files
+        (re)read. `on_write` is called with each batch of rows once written.
+        """
+        columns, read_row = self._tables[table]
+        with self._lock:
+            known = {row[0]: (row[1], row[2]) for row in
+                     self._conn.execute(f"SELECT path, mtime, file_size FROM {table}")}
+        pending = []
+        updated = 0
+        for path in paths:
+            if stop_event is not None and stop_event.is_set():
+                break
+            rel = self.relpath(path)
+            try:
+                st = os.stat(path)
+                if known.get(rel) == (st.st_mtime, st.st_size):
+                    continue
+                row = read_row(path)
+            except Exception as e:
+                print(f"Could not index {path}: {e}")
+                continue
+            pending.append((rel,) + tuple(row[c] for c in columns))
+            updated += 1
+            if len(pending) >= self.COMMIT_EVERY:
+                self._write_rows(table, columns, pending)
+                if on_write is not None:
+                    on_write(pending)
+                pending = []
+        if pending:
+            self._write_rows(table, columns, pending)
+            if on_write is not None:
+                on_write(pending)
+        return updated
+
+    def _write_rows(self, table, columns, rows):
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (path, {', '.join(columns)}) VALUES ({placeholders})", rows)
+
+    def prune(self, existing_paths, table="images"):
+        """Removes rows of files that no longer exist."""
+        existing = {self.relpath(p) for p in existing_paths}
+        with self._lock:
+            stale = [(rel,) for (rel,) in self._conn.execute(f"SELECT path FROM {table}") if rel not in existing]
+            with self._conn:
+                self._conn.executemany(f"DELETE FROM {table} WHERE path = ?", stale)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class FolderIndexer(threading.Thread):
+    """
+    Feeds scanned paths into a FolderIndex in the background. Paths are added
+    while the folder is still being scanned; `finish` is called once the scan
+    is complete so rows of deleted files can be pruned.
+    """
+    TABLE = "images"
+
+    def __init__(self, index):
+        super().__init__(daemon=True)
+        self.index = index
+        self.paths = queue.Queue()
+        self.stop_event = threading.Event()
+        self.done = False
+        self.updated = 0
+        self._seen = []
+
+    def add(self, paths):
+        self.paths.put(list(paths))
+
+    def finish(self):
+        self.paths.put(None)
+
+    def stop(self):
+        self.stop_event.set()
+        self.paths.put(None)
+
+    def run(self):
+        complete = False
+        try:
+            while not self.stop_event.is_set():
+                batch = self.paths.get()
+                if batch is None:
+                    complete = not self.stop_event.is_set()
+                    break
+                self._seen.extend(batch)
+                self.updated += self.index.update(batch, self.stop_event, self.TABLE, self._written)
+            if complete:
+                self.index.prune(self._seen, self.TABLE)
+        except sqlite3.Error as e:
+            print(f"Folder index update failed: {e}")
+        finally:
+            self.done = True
+
+    def _written(self, rows):
+        """Called with each batch of rows written to the index."""
+
+class HashIndexer(FolderIndexer):
+    """
+    Computes perceptual hashes for near-duplicate clustering. Runs next to the
+    header indexer because hashing needs a (reduced) decode of every file.
+    Each batch of new or changed hashes ({path: hash}) is put on `found` for
+    the Tk thread.
+    """
+    TABLE = "hashes"
+
+    def __init__(self, index):
+        super().__init__(index)
+        self.found = queue.Queue()
+
+    def _written(self, rows):
+        self.found.put({self.index.abspath(row[0]): int(row[1], 16) for row in rows})
+
+def find_near_duplicates(folder, max_depth=0, max_distance=10):
+    """
+    Hashes every image in `folder`, reusing hashes cached in the folder index,
+    and returns (clusters of near-duplicate paths, number of files hashed now).
+    """
+    paths = list(iter_image_files(folder, max_depth))
+    index = FolderIndex(folder)
+    try:
+        hashed = index.update(paths, table="hashes")
+        index.prune(paths, "hashes")
+        hashes = index.load_hashes()
+    finally:
+        index.close()
+    return cluster_near_duplicates(hashes, max_distance), hashed
+
+class ReviewSession:
+    """
+    Persistent review state for one folder, stored next to the metadata
+    index. Every decision (keep/discard/modify) and the completion status of
+    its processing job is recorded per file, so a folder can be closed and
+    reopened without showing or processing anything twice.
+
+    Writes go through a background thread that commits in small batches, so
+    a keypress never waits for the database (which may be on a network share).
+    """
+    FLUSH_INTERVAL = 0.5  # seconds
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.db_path = os.path.join(folder, FOLDER_DB_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS decisions ("
+                "path TEXT PRIMARY KEY, decision TEXT NOT NULL, job_status TEXT NOT NULL, "
+                "output TEXT, decided_at REAL, completed_at REAL, job_id TEXT)"
+            )
+            # Databases from before spooled jobs lack the job id
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(decisions)")}
+            if "job_id" not in columns:
+                try:
+                    self._conn.execute("ALTER TABLE decisions ADD COLUMN job_id TEXT")
+                except sqlite3.OperationalError:
+                    pass  # Added by another reviewer of the same folder just now
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.folder).replace(os.sep, "/")
+
+    def abspath(self, rel):
+        return os.path.join(self.folder, *rel.split("/"))
+
+    def decided_paths(self):
+        """Returns the absolute paths of all files that already have a decision."""
+        with self._lock:
+            return {self.abspath(rel) for (rel,) in self._conn.execute("SELECT path FROM decisions")}
+
+    def unfinished_jobs(self):
+        """Returns [(absolute path, decision, job status, job id)] for jobs that failed or never completed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT path, decision, job_status, job_id FROM decisions WHERE job_status IN ('pending', 'failed')")
+            return [(self.abspath(rel), decision, status, job_id) for rel, decision, status, job_id in cursor]
+
+    def record_decision(self, path, decision, job_id=None):
+        job_status = "none" if decision == "discard" else "pending"
+        self._writes.put((
+            "INSERT OR REPLACE INTO decisions (path, decision, job_status, decided_at, job_id) VALUES (?, ?, ?, ?, ?)",
+            (self.relpath(path), decision, job_status, time.time(), job_id),
+        ))
+
+    def record_job_status(self, path, status, output=None):
+        """Called from worker threads when a job finished ('done' or 'failed')."""
+        if output is not None:
+            output = os.path.abspath(output)
+        self._writes.put((
+            "UPDATE decisions SET job_status = ?, output = ?, completed_at = ? WHERE path = ?",
+            (status, output, time.time(), self.relpath(path)),
+        ))
+
+    def _write_loop(self):
+        closing = False
+        while not closing:
+            batch = [self._writes.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            while True:
+                try:
+                    batch.append(self._writes.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = [w for w in batch if w is not None]
+            try:
+                with self._lock, self._conn:
+                    for sql, params in batch:
+                        self._conn.execute(sql, params)
+            except sqlite3.Error as e:
+                print(f"!!! Could not save review progress: {e}")
+        with self._lock:
+            self._conn.close()
+
+    def close(self):
+        """Flushes pending writes and closes the database."""
+        self._writes.put(None)
+        self._writer.join()
+
+class ReviewLeases:
+    """
+    Coordinates several reviewers working on the same (shared) folder. The
+    folder's files are split into a fixed number of chunks by a hash of
+    their relative path, so every reviewer computes the same partition
+    without a shared file list, even while the folder is still being
+    scanned. A reviewer leases one chunk at a time from a table in the
+    folder database, renews its leases while it runs, and marks the chunk
+    done once its queue runs dry.
+
+    Leases of a reviewer that crashed or lost the share expire after
+    `lease_seconds` and are handed out again. Its decisions are already in
+    the shared decisions table, so the next owner only sees what is left.
+
+    The database may be on a shared drive: use it through a LeaseKeeper,
+    not from the Tk thread.
+    """
+    def __init__(self, folder, owner, chunks=64, lease_seconds=300):
+        self.folder = folder
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        # Autocommit mode: lease changes use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(os.path.join(folder, FOLDER_DB_NAME), timeout=30, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lease_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "chunk INTEGER PRIMARY KEY, owner TEXT, expires REAL, done INTEGER NOT NULL DEFAULT 0)"
+        )
+        # The first reviewer fixes the number of chunks for everybody
+        self._conn.execute("INSERT OR IGNORE INTO lease_meta VALUES ('chunks', ?)", (str(chunks),))
+        self.chunks = int(self._conn.execute("SELECT value FROM lease_meta WHERE key = 'chunks'").fetchone()[0])
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def acquire(self, skip=()):
+        """
+        Leases the next chunk nobody holds (never leased, or expired), other
+        than those in `skip`. Returns it, or None if none is left.
+        """
+        now = time.time()
+        with self._transaction():
+            taken = {chunk for (chunk,) in self._conn.execute(
+                "SELECT chunk FROM leases WHERE done = 1 OR (expires > ? AND owner != ?)", (now, self.owner))}
+            free = [chunk for chunk in range(self.chunks)
+                    if chunk not in taken and chunk not in self.held and chunk not in skip]
+            if not free:
+                return None
+            self._conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?, 0)",
+                               (free[0], self.owner, now + self.lease_seconds))
+        self.held.add(free[0])
+        return free[0]
+
+    def renew(self):
+        """Extends the held leases. Returns the chunks that expired and went to another reviewer."""
+        with self._transaction():
+            owned = {chunk for (chunk,) in self._conn.execute(
+                "SELECT chunk FROM leases WHERE owner = ? AND done = 0", (self.owner,))}
+            self._conn.execute("UPDATE leases SET expires = ? WHERE owner = ? AND done = 0",
+                               (time.time() + self.lease_seconds, self.owner))
+        lost = self.held - owned
+        self.held &= owned
+        return lost
+
+    def complete(self, chunks):
+        """Marks held chunks as reviewed, for every reviewer."""
+        chunks = self.held & set(chunks)
+        with self._transaction():
+            self._conn.executemany("UPDATE leases SET done = 1 WHERE chunk = ? AND owner = ?",
+                                   [(chunk, self.owner) for chunk in chunks])
+        self.held -= chunks
+
+    def hand_back(self, chunks):
+        """Gives up held chunks that are not finished, so other reviewers can lease them right away."""
+        chunks = self.held & set(chunks)
+        with self._transaction():
+            self._conn.executemany("UPDATE leases SET owner = NULL, expires = 0 WHERE chunk = ? AND owner = ?",
+                                   [(chunk, self.owner) for chunk in chunks])
+        self.held -= chunks
+
+    def progress(self):
+        """Returns (chunks done, chunks leased by other reviewers, all chunks)."""
+        done, others = self._conn.execute(
+            "SELECT COALESCE(SUM(done), 0), COALESCE(SUM(done = 0 AND owner != ? AND expires > ?), 0) FROM leases",
+            (self.owner, time.time())).fetchone()
+        return done, others, self.chunks
+
+    def release(self):
+        """Hands unfinished chunks back right away instead of letting them expire, and closes the database."""
+        try:
+            with self._transaction():
+                self._conn.execute("UPDATE leases SET owner = NULL, expires = 0 WHERE owner = ? AND done = 0",
+                                   (self.owner,))
+        finally:
+            self.held.clear()
+            self._conn.close()
+
+def lease_chunk(folder, path, chunks):
+    """The chunk of `path` among `chunks`, the same on every reviewer's machine."""
+    rel = os.path.relpath(path, folder).replace(os.sep, "/")
+    return int(hashlib.md5(rel.encode("utf-8")).hexdigest()[:8], 16) % chunks
+
+LEASE_PROGRESS_INTERVAL = 2.0  # Seconds between reads of the shared review progress
+
+class LeaseKeeper(threading.Thread):
+    """
+    Runs the ReviewLeases of one reviewer on a thread of its own, so the Tk
+    thread never waits for the folder database on the shared drive. The
+    keeper leases the first chunk, renews the leases every third of
+    `lease_seconds` and reads the progress every LEASE_PROGRESS_INTERVAL.
+    `next_chunk` asks it to settle chunks and lease another one. Results go
+    to `results` as (kind, value) for the Tk thread:
+
+        ("opened", (chunks, held) or the error)
+        ("leased", (chunk or None, held, paths decided by now))
+        ("renewed", (chunks lost to other reviewers, held))
+        ("progress", (chunks done, chunks with other reviewers, chunks))
+
+    Leases are handed back when the keeper stops.
+    """
+    def __init__(self, folder, owner, chunks, lease_seconds):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.owner = owner
+        self.chunks = chunks  # The first reviewer's value wins; corrected once opened
+        self.lease_seconds = lease_seconds
+        self.results = queue.Queue()
+        self._requests = queue.Queue()
+        self._chunk_of = {}
+
+    def chunk_of(self, path):
+        """The chunk of `path` (Tk thread, no database access). Only valid once opened."""
+        chunk = self._chunk_of.get(path)
+        if chunk is None:
+            chunk = self._chunk_of[path] = lease_chunk(self.folder, path, self.chunks)
+        return chunk
+
+    def next_chunk(self, finished, hidden, skip, session):
+        """Marks `finished` chunks done, hands `hidden` ones back and leases a chunk not in `skip`."""
+        self._requests.put((set(finished), set(hidden), set(skip), session))
+
+    def stop(self):
+        self._requests.put(None)
+
+    def run(self):
+        try:
+            leases = ReviewLeases(self.folder, self.owner, self.chunks, self.lease_seconds)
+            leases.acquire()
+        except sqlite3.Error as e:
+            self.results.put(("opened", e))
+            return
+        self.chunks = leases.chunks
+        self.results.put(("opened", (leases.chunks, set(leases.held))))
+        renew_every = self.lease_seconds / 3
+        next_renew = time.monotonic() + renew_every
+        next_progress = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_progress:
+                    self._progress(leases)
+                    next_progress = now + LEASE_PROGRESS_INTERVAL
+                if now >= next_renew:
+                    try:
+                        lost = leases.renew()
+                    except sqlite3.Error as e:
+                        print(f"Could not renew review leases, retrying: {e}")
+                        lost = set()
+                    self.results.put(("renewed", (lost, set(leases.held))))
+                    next_renew = now + renew_every
+                try:
+                    request = self._requests.get(timeout=max(0.0, min(next_progress, next_renew) - now))
+                except queue.Empty:
+                    continue
+                if request is None:
+                    break
+                self._lease_next(leases, *request)
+                self._progress(leases)
+        finally:
+            try:
+                leases.release()
+            except sqlite3.Error as e:
+                print(f"Could not release review leases, they will expire: {e}")
+
+    def _lease_next(self, leases, finished, hidden, skip, session):
+        chunk, decided = None, set()
+        try:
+            leases.complete(finished)
+            leases.hand_back(hidden)
+            chunk = leases.acquire(skip)
+            # Picks up what the last owner of a reclaimed chunk already decided
+            if chunk is not None and session:
+                decided = session.decided_paths()
+        except sqlite3.Error as e:
+            print(f"Could not lease more images: {e}")
+        self.results.put(("leased", (chunk, set(leases.held), decided)))
+
+    def _progress(self, leases):
+        try:
+            self.results.put(("progress", leases.progress()))
+        except sqlite3.Error:
+            pass
+
+# Queue orderings offered in the UI: name -> (key on index row, reverse)
+QUEUE_ORDERS = {
+    "Name": None,
+    "Capture date (oldest first)": (lambda row: row["captured"] or "", False),
+    "Capture date (newest first)": (lambda row: row["captured"] or "", True),
+    "Resolution (largest first)": (lambda row: row["width"] * row["height"], True),
+    "File size (largest first)": (lambda row: row["file_size"], True),
+    "Format": (lambda row: row["format"] or "", False),
+}
+QUEUE_FORMAT_FILTERS = ["All formats", "JPEG", "PNG", "WEBP", "TIFF", "GIF", "BMP"]
+
+class OutputNameAllocator:
+    """
+    Hands out unique, camera-style output names (IMG_YYYYMMDD_HHMMSS.jpg)
+    with strictly increasing capture times for one output folder.
+
+    Names stay unique across threads and across processes writing to the
+    same (possibly shared) folder: each process reserves a block of seconds
+    from a small state file guarded by a lock file, then allocates from that
+    block in memory, so the lock is taken only once per block and no
+    directory listing is needed. Times start in the morning and advance by a
+    few random seconds per photo. If a day runs out of seconds, a burst
+    suffix (_1, _2, ...) keeps the names unique. If the state file is lost,
+    the folder is listed once and allocation resumes after the newest name
+    of the day, so existing outputs are never overwritten.
+
+    The lock file holds its owner (host:pid:token). A lock of a process on
+    this host that no longer runs is stale at once; a lock from another host
+    is stale once it has stayed unchanged for LOCK_TIMEOUT on our own clock,
+    so clock skew between hosts doesn't matter.
+    """
+    STATE_FILE = ".naming_state.json"
+    LOCK_FILE = ".naming.lock"
+    BLOCK_SECONDS = 120
+    MAX_STEP = 3
+    LOCK_TIMEOUT = 10.0  # A lock unchanged for this long is considered stale
+    NAME_PATTERN = re.compile(r"IMG_(\d{8})_(\d{2})(\d{2})(\d{2})(?:_(\d+))?\.jpg$")
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._date = None
+        self._next = 0
+        self._block_end = 0
+        self._burst = 0
+        self._seq = 0
+
+    def allocate(self):
+        """
+        Returns (capture datetime, file name, sequence number). Sequence
+        numbers are unique and increasing per folder, with occasional gaps.
+        """
+        with self._lock:
+            today = datetime.now().date()
+            if self._date != today or self._next >= self._block_end:
+                self._reserve_block(today)
+            second = self._next
+            self._next += random.randint(1, self.MAX_STEP)
+            seq = self._seq
+            self._seq += 1
+            photo_datetime = datetime.combine(today, datetime.min.time()) + timedelta(seconds=second)
+            suffix = f"_{self._burst}" if self._burst else ""
+            return photo_datetime, f"IMG_{photo_datetime.strftime('%Y%m%d_%H%M%S')}{suffix}.jpg", seq
+
+    def _reserve_block(self, today):
+        os.makedirs(self.folder, exist_ok=True)
+        with self._folder_lock():
+            state_path = os.path.join(self.folder, self.STATE_FILE)
+            try:
+                with open(state_path, "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = self._recover_state(today)
+            if state.get("date") != today.isoformat():
+                # First photo of the day somewhere between 7 and 9 am
+                state = {"date": today.isoformat(), "next": random.randint(7 * 3600, 9 * 3600), "burst": 0,
+                         "seq": state.get("seq", 0)}
+            if state["next"] + self.BLOCK_SECONDS > 24 * 3600:
+                state["next"] = random.randint(7 * 3600, 9 * 3600)
+                state["burst"] += 1
+            self._date = today
+            self._next = state["next"]
+            self._block_end = state["next"] + self.BLOCK_SECONDS
+            self._burst = state["burst"]
+            # A block never yields more names than it has seconds
+            self._seq = state.get("seq", 0)
+            state["seq"] = self._seq + self.BLOCK_SECONDS
+            state["next"] = self._block_end
+            with atomic_output(state_path) as tmp_path:
+                with open(tmp_path, "w") as f:
+                    json.dump(state, f)
+
+    def _recover_state(self, today):
+        """Rebuilds a missing state file from the names of today's outputs (in any shard)."""
+        day = today.strftime("%Y%m%d")
+        latest = None  # (burst, second)
+        for root, dirs, files in os.walk(self.folder):
+            for name in files:
+                match = self.NAME_PATTERN.match(name)
+                if match and match.group(1) == day:
+                    hours, minutes, seconds = (int(match.group(i)) for i in (2, 3, 4))
+                    found = (int(match.group(5) or 0), hours * 3600 + minutes * 60 + seconds)
+                    latest = max(latest or found, found)
+        if latest is None:
+            return {}
+        print(f"Naming state of {self.folder} was missing, continuing after the existing outputs of today")
+        return {"date": today.isoformat(), "next": latest[1] + 1, "burst": latest[0], "seq": 0}
+
+    @contextmanager
+    def _folder_lock(self):
+        lock_path = os.path.join(self.folder, self.LOCK_FILE)
+        owner = f"{platform.node()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        seen = {}  # Owner -> when we first saw that lock (monotonic)
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, owner.encode("utf-8"))
+                break
+            except FileExistsError:
+                try:
+                    if self._lock_is_stale(lock_path, seen):
+                        os.remove(lock_path)  # Left behind by a crashed process
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.005)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def _lock_is_stale(self, lock_path, seen):
+        with open(lock_path, "r", encoding="utf-8", errors="replace") as f:
+            holder = f.read()
+        host, _, pid = holder.partition(":")
+        pid = pid.partition(":")[0]
+        if host == platform.node() and pid.isdigit() and sys.platform != "win32":
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass  # Runs, as another user
+        # Also covers a lock whose owner hasn't written its name yet
+        first_seen = seen.setdefault(holder, time.monotonic())
+        return time.monotonic() - first_seen > self.LOCK_TIMEOUT
+
+_name_allocators = {}
+_name_allocators_lock = threading.Lock()
+
+def get_name_allocator(folder):
+    """Returns the shared OutputNameAllocator for an output folder."""
+    key = os.path.normcase(os.path.abspath(folder))
+    with _name_allocators_lock:
+        if key not in _name_allocators:
+            _name_allocators[key] = OutputNameAllocator(folder)
+        return _name_allocators[key]
+
+_created_dirs = set()
+_created_dirs_lock = threading.Lock()
+
+def ensure_dir(path):
+    """os.makedirs with a process-wide cache, so workers don't repeat it per job."""
+    if path in _created_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    with _created_dirs_lock:
+        _created_dirs.add(path)
+
+def write_in_dir(path, write):
+    """
+    Calls write(), a write of a file into the folder `path` made with
+    ensure_dir. If the folder has been removed since (FileNotFoundError), it
+    is dropped from the cache, created again and the write is retried once.
+    """
+    try:
+        return write()
+    except FileNotFoundError:
+        with _created_dirs_lock:
+            _created_dirs.discard(path)
+        ensure_dir(path)
+        return write()
+
+def output_shard(layout, output_name, photo_datetime, seq, shard_size):
+    """Returns the subfolder (relative, '/'-separated) an output goes into for `layout`."""
+    if layout == "date":
+        return photo_datetime.strftime("%Y-%m-%d")
+    if layout == "hash":
+        return hashlib.md5(output_name.encode("utf-8")).hexdigest()[:2]
+    if layout == "count":
+        return f"{seq // max(1, shard_size):05d}"
+    return ""
+
+class ManifestWriter:
+    """
+    Appends one JSON line per finished job (source, output and archive path,
+    relative to the output folder) to the manifest of each keep/modify folder.
+    Files stay open for the lifetime of the app; lines are flushed right away.
+    """
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def append(self, folder, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            f = self._files.get(folder)
+            if f is None:
+                f = self._files[folder] = open(os.path.join(folder, MANIFEST_FILE), "a", encoding="utf-8")
+            f.write(line)
+            f.flush()
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+manifest_writer = ManifestWriter()
+
+# ---------------- Processed sources ----------------
+QUICK_HASH_BLOCK = 64 * 1024  # Bytes hashed from the start and from the end of a file
+
+def quick_hash(path, data=None):
+    """
+    Hash of the file size, the first and the last QUICK_HASH_BLOCK bytes.
+    Reads at most two blocks, so whole folders can be compared in seconds;
+    a match only makes a file a candidate for the full content hash.
+    """
+    digest = hashlib.sha256()
+    if data is not None:
+        size = len(data)
+        head, tail = data[:QUICK_HASH_BLOCK], data[max(size - QUICK_HASH_BLOCK, QUICK_HASH_BLOCK):]
+    else:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(QUICK_HASH_BLOCK)
+            f.seek(max(size - QUICK_HASH_BLOCK, QUICK_HASH_BLOCK))
+            tail = f.read(QUICK_HASH_BLOCK)
+    digest.update(str(size).encode("ascii"))
+    digest.update(head)
+    digest.update(tail)
+    return digest.hexdigest()
+
+def content_hash(path, data=None):
+    """SHA-256 of the whole file."""
+    if data is not None:
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ProcessedIndex:
+    """
+    App-wide SQLite index mapping the content of every kept or modified
+    source to the output it produced, so the same image is not processed
+    again from another folder or in a later session. Lookups compare the
+    file size first (from memory), then the quick hash, and read the whole
+    file only when both match.
+    """
+    def __init__(self, path=PROCESSED_INDEX_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources (sha256 TEXT, file_size INTEGER, quick_hash TEXT, "
+                "src TEXT, subfolder TEXT, output TEXT, time REAL, UNIQUE (sha256, output))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sources_quick ON sources (file_size, quick_hash)")
+            self._sizes = {size for (size,) in self._conn.execute("SELECT DISTINCT file_size FROM sources")}
+
+    def add(self, src_path, output, subfolder, data=None):
+        """Records that `src_path` was processed into `output`. `data` saves re-reading the file."""
+        size = len(data) if data is not None else os.path.getsize(src_path)
+        row = (content_hash(src_path, data), size, quick_hash(src_path, data),
+               os.path.abspath(src_path), subfolder, os.path.abspath(output), time.time())
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+            self._sizes.add(size)
+
+    def lookup(self, paths, stop_event=None):
+        """Returns {path: {"src", "subfolder", "output"}} for every path whose content was processed before."""
+        found = {}
+        for path in paths:
+            if stop_event is not None and stop_event.is_set():
+                break
+            try:
+                size = os.path.getsize(path)
+                if size not in self._sizes:
+                    continue
+                quick = quick_hash(path)
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT sha256, src, subfolder, output FROM sources WHERE file_size = ? AND quick_hash = ?",
+                        (size, quick)).fetchall()
+                if not rows:
+                    continue
+                full = content_hash(path)
+            except OSError as e:
+                print(f"Could not check {path}: {e}")
+                continue
+            for sha256, src, subfolder, output in rows:
+                if sha256 == full:
+                    found[path] = {"src": src, "subfolder": subfolder, "output": output}
+                    break
+        return found
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_processed_index = None
+_processed_index_lock = threading.Lock()
+
+def get_processed_index():
+    """Returns the shared ProcessedIndex, opening it on first use (None if it cannot be opened)."""
+    global _processed_index
+    with _processed_index_lock:
+        if _processed_index is None:
+            try:
+                _processed_index = ProcessedIndex()
+            except sqlite3.Error as e:
+                print(f"!!! Processed-source index unavailable, sources may be processed twice: {e}")
+                return None
+        return _processed_index
+
+def close_processed_index():
+    global _processed_index
+    with _processed_index_lock:
+        if _processed_index is not None:
+            _processed_index.close()
+            _processed_index = None
+
+class ProcessedSourceChecker(FolderIndexer):
+    """
+    Looks up scanned paths in the ProcessedIndex in the background. Each
+    batch of matches ({path: record}) is put on `found` for the Tk thread.
+    """
+    def __init__(self, index):
+        super().__init__(index)
+        self.found = queue.Queue()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                batch = self.paths.get()
+                if batch is None:
+                    break
+                found = self.index.lookup(batch, self.stop_event)
+                if found:
+                    self.found.put(found)
+                    self.updated += len(found)
+        except sqlite3.Error as e:
+            print(f"Processed-source check failed: {e}")
+        finally:
+            self.done = True
+
+# ---------------- Metrics ----------------
+# Stages timed for every job
+METRIC_STAGES = ("archive", "decode", "effects", "exif", "encode", "write")
+# Upper bounds (ms) of the stage duration histogram buckets
+METRIC_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+PROMETHEUS_FILE_INTERVAL = 5.0  # Seconds between rewrites of the Prometheus text file
+
+class _Span:
+    __slots__ = ("metrics", "stage", "record", "start")
+
+    def __init__(self, metrics, stage, record):
+        self.metrics = metrics
+        self.stage = stage
+        self.record = record
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, (time.perf_counter() - self.start) * 1000, self.record)
+        return False
+
+_NO_SPAN = nullcontext()
+
+class Metrics:
+    """
+    Per-job stage timings, byte counters and stage histograms.
+
+    A job record is started with `begin_job` on the thread doing the CPU work
+    and picked up there by `span()` and `add_bytes()`; threads working for a
+    job elsewhere (I/O writers) pass the record explicitly. `end_job` appends
+    the record as one JSON line to the metrics file. Totals can also be
+    exposed in the Prometheus text format, as a file rewritten every few
+    seconds and/or on http://127.0.0.1:<port>/metrics.
+
+    Until `configure` is called everything is a no-op; a disabled span costs
+    one attribute check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+        self._prometheus_file = None
+        self._prometheus_written = 0.0
+        self._server = None
+        self._reset()
+
+    def _reset(self):
+        self._counters = {"bytes_read": 0, "bytes_written": 0}
+        self._jobs = {}  # status -> count
+        self._histograms = {stage: [0] * (len(METRIC_BUCKETS_MS) + 1) for stage in METRIC_STAGES}
+        self._sums = {stage: 0.0 for stage in METRIC_STAGES}
+
+    @property
+    def logs_jobs(self):
+        """True if job records are written to a metrics file."""
+        return self._file is not None
+
+    def collect_in_memory(self, enabled=True):
+        """
+        Enables collection for stage_totals() even without any output. When
+        disabled again, collection continues only if an output is configured.
+        """
+        self.enabled = enabled or bool(self._file or self._prometheus_file or self._server)
+
+    def stage_totals(self):
+        """Returns {stage: (total ms, count)} since the start."""
+        with self._lock:
+            return {stage: (self._sums[stage], sum(self._histograms[stage])) for stage in METRIC_STAGES}
+
+    def configure(self, jsonl_path="", prometheus_file="", prometheus_port=0):
+        """Enables collection if any output is given."""
+        self.close()
+        if jsonl_path:
+            self._file = open(jsonl_path, "a", encoding="utf-8")
+        self._prometheus_file = prometheus_file or None
+        if prometheus_port:
+            self._start_server(prometheus_port)
+        self.enabled = bool(jsonl_path or prometheus_file or prometheus_port)
+
+    def begin_job(self, job):
+        """Starts the record of `job` and makes it current on this thread."""
+        if not self.enabled:
+            return None
+        record = {"job": job.get("id"), "src": job.get("src"), "subfolder": job.get("subfolder"),
+                  "start": time.time(), "ms": {}, "bytes_read": 0, "bytes_written": 0}
+        self._local.record = record
+        return record
+
+    def attach(self, record):
+        """Makes `record` current on this thread (None detaches)."""
+        if self.enabled:
+            self._local.record = record
+
+    def current(self):
+        return getattr(self._local, "record", None) if self.enabled else None
+
+    def span(self, stage, record=None):
+        """Context manager timing `stage` for `record` (default: the current job)."""
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, stage, record if record is not None else self.current())
+
+    def observe(self, stage, ms, record=None):
+        bucket = next((i for i, bound in enumerate(METRIC_BUCKETS_MS) if ms <= bound), len(METRIC_BUCKETS_MS))
+        with self._lock:
+            self._histograms[stage][bucket] += 1
+            self._sums[stage] += ms
+            if record is not None:
+                record["ms"][stage] = round(record["ms"].get(stage, 0.0) + ms, 3)
+
+    def add_bytes(self, kind, nbytes, record=None):
+        """Counts `nbytes` as "read" or "written" for `record` (default: the current job)."""
+        if not self.enabled:
+            return
+        record = record if record is not None else self.current()
+        with self._lock:
+            self._counters[f"bytes_{kind}"] += nbytes
+            if record is not None:
+                record[f"bytes_{kind}"] += nbytes
+
+    def end_job(self, record, status, output=None, error=None):
+        """Finishes a job record and appends it to the metrics file."""
+        if not self.enabled or record is None:
+            return
+        record["status"] = status
+        record["total_ms"] = round((time.time() - record["start"]) * 1000, 3)
+        if output is not None:
+            record["output"] = output
+        if error is not None:
+            record["error"] = str(error)
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._jobs[status] = self._jobs.get(status, 0) + 1
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+        if self._prometheus_file and time.monotonic() - self._prometheus_written >= PROMETHEUS_FILE_INTERVAL:
+            self.write_prometheus_file()
+
+    def render_prometheus(self):
+        """Returns all totals in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            jobs = dict(self._jobs)
+            histograms = {stage: list(counts) for stage, counts in self._histograms.items()}
+            sums = dict(self._sums)
+        lines = []
+        for kind in ("read", "written"):
+            lines += [f"# TYPE image_review_bytes_{kind}_total counter",
+                      f"image_review_bytes_{kind}_total {counters[f'bytes_{kind}']}"]
+        lines.append("# TYPE image_review_jobs_total counter")
+        lines += [f'image_review_jobs_total{{status="{status}"}} {n}' for status, n in sorted(jobs.items())]
+        lines.append("# TYPE image_review_stage_ms histogram")
+        for stage in METRIC_STAGES:
+            cumulative = 0
+            for bound, count in zip(METRIC_BUCKETS_MS + ("+Inf",), histograms[stage]):
+                cumulative += count
+                lines.append(f'image_review_stage_ms_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'image_review_stage_ms_sum{{stage="{stage}"}} {sums[stage]:.3f}')
+            lines.append(f'image_review_stage_ms_count{{stage="{stage}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_file(self):
+        if not self._prometheus_file:
+            return
+        self._prometheus_written = time.monotonic()
+        try:
+            with atomic_output(self._prometheus_file) as tmp_path:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(self.render_prometheus())
+        except OSError as e:
+            print(f"Could not write metrics to {self._prometheus_file}: {e}")
+
+    def _start_server(self, port):
+        metrics = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http_server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.enabled:
+            self.write_prometheus_file()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self.enabled = False
+
+metrics = Metrics()
+
+def configure_metrics(config):
+    """Enables metrics from the config (metrics_file, metrics_prometheus_file, metrics_prometheus_port)."""
+    try:
+        metrics.configure(config["metrics_file"], config["metrics_prometheus_file"],
+                          config["metrics_prometheus_port"])
+    except OSError as e:
+        print(f"Metrics disabled: {e}")
+
+# ---------------- Profiler ----------------
+PROFILE_MODES = ("sampling", "cprofile")
+# "<mode>" or "<mode>:<seconds>" profiles from startup (GUI and --batch)
+PROFILE_ENV = "IMAGE_REVIEW_PROFILE"
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+# From 3.12 cProfile is built on sys.monitoring, which allows one active profiler per process
+CPROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+class _ProfiledTask:
+    __slots__ = ("profiler", "profile")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            self.profile = None  # Another profiler is active; never fail the task over it
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler._add_profile(threading.current_thread().name, self.profile)
+        return False
+
+class Profiler:
+    """
+    Profiles the app for a time window, switched on and off at runtime.
+
+    - "sampling": a background thread records the stack of every thread
+      every PROFILE_SAMPLE_INTERVAL s. Cheap enough for production.
+    - "cprofile": additionally runs cProfile for every worker task (see
+      `task()`) and, from `start()` to `stop()`, on the thread that
+      started it (the Tk thread in the GUI). Exact call counts, but slower.
+      Python 3.12+ allows only one cProfile per process, so there this
+      mode falls back to sampling.
+
+    `stop()` writes a folder with `stacks.collapsed` (one "thread;frame;...
+    count" line per stack, for flamegraph.pl or speedscope) and a profile
+    per thread: `<thread>.prof` (pstats) for cProfile, `<thread>.txt` with
+    the top functions in both modes. start() and stop() must be called from
+    the same thread when the caller is profiled.
+    """
+    def __init__(self):
+        self.active = False
+        self.mode = None
+        self._lock = threading.Lock()
+        self._stats = {}  # thread name -> pstats.Stats
+        self._samples = Counter()  # collapsed stack -> samples
+        self._sampler = None
+        self._stop_event = threading.Event()
+        self._caller_profile = None
+        self._started = None
+
+    def start(self, mode="sampling", profile_caller=True):
+        """
+        Starts profiling. With `profile_caller` (and "cprofile"), the calling
+        thread is profiled with cProfile as well until stop().
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}; use one of {', '.join(PROFILE_MODES)}")
+        if self.active:
+            return
+        if mode == "cprofile" and not CPROFILE_PER_THREAD:
+            print("cProfile cannot profile several threads at once on Python 3.12+; using sampling")
+            mode = "sampling"
+        self.mode = mode
+        self._stats = {}
+        self._samples = Counter()
+        self._started = datetime.now()
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._sampler.start()
+        if mode == "cprofile" and profile_caller:
+            self._caller_profile = cProfile.Profile()
+            self._caller_profile.enable()
+        self.active = True
+
+    def task(self):
+        """Context manager profiling one worker task with cProfile (in "cprofile" mode)."""
+        if not self.active or self.mode != "cprofile":
+            return _NO_SPAN
+        return _ProfiledTask(self)
+
+    def _add_profile(self, thread_name, profile):
+        with self._lock:
+            stats = self._stats.get(thread_name)
+            if stats is None:
+                self._stats[thread_name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples[";".join(reversed(stack))] += 1
+
+    def stop(self, out_dir="profiles"):
+        """Stops profiling and writes the results. Returns the folder written."""
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+        self._stop_event.set()
+        self._sampler.join()
+        if self._caller_profile is not None:
+            self._caller_profile.disable()
+            self._add_profile(threading.current_thread().name, self._caller_profile)
+            self._caller_profile = None
+
+        folder = os.path.join(out_dir, f"profile_{self._started:%Y%m%d_%H%M%S}_{self.mode}")
+        ensure_dir(folder)
+        with open(os.path.join(folder, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        def file_name(thread_name):
+            return re.sub(r"[^\w.-]+", "_", thread_name)
+
+        with self._lock:
+            stats_by_thread = dict(self._stats)
+        for thread_name, stats in stats_by_thread.items():
+            stats.dump_stats(os.path.join(folder, f"{file_name(thread_name)}.prof"))
+            with open(os.path.join(folder, f"{file_name(thread_name)}.txt"), "w", encoding="utf-8") as f:
+                stats.stream = f
+                stats.sort_stats("cumulative").print_stats(40)
+        for thread_name, lines in self._sample_summaries().items():
+            if thread_name not in stats_by_thread:
+                with open(os.path.join(folder, f"{file_name(thread_name)}.txt"), "w", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+        return folder
+
+    def _sample_summaries(self, top=40):
+        """Per thread: the functions with the most samples, on top of the stack (self) and anywhere (total)."""
+        per_thread = {}
+        for stack, count in self._samples.items():
+            thread_name, *frames = stack.split(";")
+            own, total, samples = per_thread.setdefault(thread_name, (Counter(), Counter(), [0]))
+            samples[0] += count
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        summaries = {}
+        for thread_name, (own, total, samples) in per_thread.items():
+            lines = [f"{thread_name}: {samples[0]} samples every {PROFILE_SAMPLE_INTERVAL * 1000:g} ms",
+                     "", f"{'self %':>7} {'total %':>8}  function"]
+            for frame, count in total.most_common(top):
+                lines.append(f"{own[frame] / samples[0]:>7.1%} {count / samples[0]:>8.1%}  {frame}")
+            summaries[thread_name] = lines
+        return summaries
+
+profiler = Profiler()
+
+def profile_from_env():
+    """Returns (mode, seconds) requested through PROFILE_ENV, or None. 0 seconds = until exit."""
+    value = os.environ.get(PROFILE_ENV, "").strip()
+    if not value:
+        return None
+    mode, _, seconds = value.partition(":")
+    try:
+        return (mode or "sampling"), float(seconds or 0)
+    except ValueError:
+        print(f"Ignoring {PROFILE_ENV}={value!r}; expected <mode>[:<seconds>]")
+        return None
+
+# JPEG quantization tables from the JPEG standard (Annex K), natural order
+_STD_LUMA_QTABLE = [
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+]
+_STD_CHROMA_QTABLE = [
+    17, 18, 24, 47, 99, 99, 99, 99, 18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99, 47, 66, 99, 99, 99, 99, 99, 99,
+] + [99] * 32
+
+def scaled_qtables(quality, chroma_quality):
+    """Standard tables scaled like libjpeg's quality setting, with a separate chroma quality."""
+    def scale(table, q):
+        q = min(100, max(1, q))
+        factor = 5000 / q if q < 50 else 200 - 2 * q
+        return [min(255, max(1, int((v * factor + 50) // 100))) for v in table]
+    return [scale(_STD_LUMA_QTABLE, quality), scale(_STD_CHROMA_QTABLE, chroma_quality)]
+
+# JPEG encoder profiles: speed/size trade-offs for img.save()
+ENCODER_PROFILES = {
+    # Baseline Huffman tables, nothing extra; quickest to encode
+    "fastest": {"optimize": False, "progressive": False, "subsampling": "4:2:0"},
+    # Optimized Huffman tables (lossless, smaller); subsampling follows quality like before
+    "balanced": {"optimize": True, "progressive": False, "subsampling": None},
+    # Progressive scans plus coarser chroma quantization
+    "smallest": {"optimize": True, "progressive": True, "subsampling": "4:2:0", "chroma_quality_offset": -15},
+}
+
+# Serializes encodes that need a larger ImageFile.MAXBLOCK, which is a module global
+_jpeg_buffer_lock = threading.Lock()
+
+def save_jpeg(img, target, exif, options):
+    """
+    img.save() as JPEG. Pillow sizes its output buffer for optimized or
+    progressive encodes from the pixel count, which very noisy images can
+    exceed ("Suspension not allowed here", about 3 bytes per pixel at high
+    quality); those are encoded again with ImageFile.MAXBLOCK raised to the
+    worst case, keeping all the passes.
+    """
+    try:
+        img.save(target, "jpeg", exif=exif, **options)
+    except OSError:
+        if not (options.get("optimize") or options.get("progressive")):
+            raise
+        if hasattr(target, "seek"):
+            target.seek(0)
+            target.truncate()
+        needed = (len(img.getbands()) + 1) * img.width * img.height + len(exif or b"") + 65536
+        with _jpeg_buffer_lock:
+            maxblock = ImageFile.MAXBLOCK
+            ImageFile.MAXBLOCK = max(maxblock, needed)
+            try:
+                img.save(target, "jpeg", exif=exif, **options)
+            finally:
+                ImageFile.MAXBLOCK = maxblock
+
+def encoder_options(profile, quality):
+    """Returns the img.save() keyword arguments for a JPEG encoder profile."""
+    settings = ENCODER_PROFILES.get(profile, ENCODER_PROFILES["balanced"])
+    options = {
+        "optimize": settings["optimize"],
+        "progressive": settings["progressive"],
+        # Chroma subsampling for authenticity, like phone cameras
+        "subsampling": settings["subsampling"] or ('4:2:0' if quality < 90 else '4:4:4'),
+    }
+    if "chroma_quality_offset" in settings:
+        options["qtables"] = scaled_qtables(quality, quality + settings["chroma_quality_offset"])
+    else:
+        options["quality"] = quality
+    return options
+
+class JpegSizeModel:
+    """
+    Predicts the JPEG quality that lands just under a byte budget.
+
+    For every encoder profile it keeps a curve of typical log(bytes per
+    pixel) per quality, learned from all previous encodes. For a new image
+    the curve is shifted by how much larger or smaller this image encodes
+    than typical, measured after the first encode; when two encodes of the
+    same image are known, the local slope between them is used instead.
+    The search stops once the next quality step is measured or predicted to
+    exceed the budget, which takes about two encodes per image instead of a
+    full binary search (occasionally one step below the true optimum).
+    """
+    MIN_QUALITY = 30
+    MAX_QUALITY = 95
+    MAX_ENCODES = 6
+    SAFETY = 0.03  # Aim this much (in log size) below the budget
+    LEARNING_RATE = 0.2
+
+    def __init__(self):
+        self._curves = {}
+        self._lock = threading.Lock()
+        self.images = 0
+        self.encodes = 0
+
+    def _curve(self, profile):
+        # Seed: libjpeg's quantization step shrinks like (100 - quality), so log
+        # size grows roughly with -log(101 - quality); ~0.25 bytes/pixel at 75
+        if profile not in self._curves:
+            curve = {q: np.log(0.25) - np.log((101 - q) / 26) for q in range(self.MIN_QUALITY, self.MAX_QUALITY + 1)}
+            if ENCODER_PROFILES.get(profile, {}).get("subsampling") is None:
+                # Quality-dependent subsampling: full-resolution chroma from 90 up
+                for q in range(90, self.MAX_QUALITY + 1):
+                    curve[q] += 0.35
+            self._curves[profile] = curve
+        return self._curves[profile]
+
+    def _predict(self, curve, log_budget, offset, cap):
+        """Highest quality up to `cap` whose predicted log size fits the budget."""
+        for q in range(cap, self.MIN_QUALITY - 1, -1):
+            if curve[q] + offset <= log_budget - self.SAFETY:
+                return q
+        return self.MIN_QUALITY
+
+    def encode(self, img, max_bytes, profile, exif, max_quality=MAX_QUALITY):
+        """
+        Encodes `img` at the highest quality (<= max_quality) found within
+        `max_bytes`. Returns (jpeg bytes, quality, number of encodes).
+        """
+        pixels = img.width * img.height
+        log_budget = np.log(max_bytes / pixels)
+        max_quality = min(max_quality, self.MAX_QUALITY)
+        with self._lock:
+            curve = dict(self._curve(profile))
+        observed = {}  # quality -> (log bytes per pixel, data)
+
+        def attempt(q):
+            buffer = io.BytesIO()
+            save_jpeg(img, buffer, exif, encoder_options(profile, q))
+            data = buffer.getvalue()
+            observed[q] = (np.log(len(data) / pixels), data)
+
+        def local_slope(q):
+            # Size change per quality step near q: measured if possible, else from the curve
+            near = sorted(observed, key=lambda k: abs(k - q))[:2]
+            if len(near) == 2 and observed[near[0]][0] != observed[near[1]][0]:
+                (q1, q2) = near
+                return (observed[q2][0] - observed[q1][0]) / (q2 - q1)
+            q = min(q, max_quality - 1)
+            return curve[q + 1] - curve[q]
+
+        q = self._predict(curve, log_budget, 0.0, max_quality)
+        attempt(q)
+        while len(observed) < self.MAX_ENCODES:
+            fitting = [k for k in observed if len(observed[k][1]) <= max_bytes]
+            failing = [k for k in observed if len(observed[k][1]) > max_bytes]
+            lo = max(fitting) if fitting else self.MIN_QUALITY - 1
+            hi = min(failing) if failing else max_quality + 1
+            if hi - lo <= 1:
+                break  # Proven: lo fits and lo + 1 does not (or is out of range)
+            if fitting and observed[lo][0] + local_slope(lo) > log_budget:
+                break  # The next step up is predicted not to fit
+            # Shift the curve by what this image measured closest to the budget
+            anchor = lo if fitting else hi
+            offset = observed[anchor][0] - curve[anchor]
+            if len(observed) >= 2:
+                slope = local_slope(anchor)
+                guess = anchor + int(np.floor((log_budget - self.SAFETY - observed[anchor][0]) / slope)) if slope > 0 else lo + 1
+            else:
+                guess = self._predict(curve, log_budget, offset, hi - 1)
+            q = min(hi - 1, max(lo + 1, guess))
+            if q in observed:
+                break
+            attempt(q)
+        fitting = [k for k in observed if len(observed[k][1]) <= max_bytes]
+        best = max(fitting) if fitting else min(observed)
+
+        with self._lock:
+            curve = self._curve(profile)
+            # Move the typical level towards this image, then correct the
+            # curve shape at the measured qualities
+            shift = float(np.mean([y - curve[k] for k, (y, _) in observed.items()]))
+            residuals = {k: y - shift - curve[k] for k, (y, _) in observed.items()}
+            for q in curve:
+                curve[q] += self.LEARNING_RATE * shift
+                for k, residual in residuals.items():
+                    # Spread each shape correction over neighbouring qualities
+                    curve[q] += self.LEARNING_RATE * residual * np.exp(-abs(q - k) / 3)
+            self.images += 1
+            self.encodes += len(observed)
+        return observed[best][1], best, len(observed)
+
+    def encodes_per_image(self):
+        with self._lock:
+            return self.encodes / self.images if self.images else 0.0
+
+size_model = JpegSizeModel()
+
+def save_with_settings(src_path, dst_path, settings, frame=None, photo_datetime=None):
+    """save_with_metadata_and_effects with the options of a job's settings snapshot."""
+    save_with_metadata_and_effects(src_path, dst_path, settings["quality"], settings["apply_effects"],
+                                   frame=frame, photo_datetime=photo_datetime,
+                                   encoder_profile=settings.get("encoder_profile", "balanced"),
+                                   target_bytes=settings.get("target_size_kb", 0) * 1024,
+                                   downscale=settings.get("downscale_to_device", False),
+                                   frame_selection=settings.get("frame_selection", "first"))
+
+def calibrate_encoder_profiles(paths, quality, sample_size=20):
+    """
+    Encodes a random sample of `paths` with every encoder profile and returns
+    {profile: {"ms": mean encode ms per image, "bytes": mean bytes per image}}.
+    Images are decoded once up front, so only the encoder is measured.
+    """
+    images = []
+    for path in random.sample(list(paths), min(sample_size, len(paths))):
+        try:
+            with Image.open(path) as img:
+                images.append(img.convert('RGB') if img.mode != 'RGB' else img.copy())
+        except Exception as e:
+            print(f"Skipping {path} for calibration: {e}")
+    results = {}
+    for profile in ENCODER_PROFILES:
+        options = encoder_options(profile, quality)
+        total_ms = total_bytes = 0
+        for img in images:
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            save_jpeg(img, buffer, b"", options)
+            total_ms += (time.perf_counter() - start) * 1000
+            total_bytes += buffer.tell()
+        if images:
+            results[profile] = {"ms": total_ms / len(images), "bytes": total_bytes / len(images)}
+    return results
+
+def format_calibration(results):
+    lines = [f"{'Profile':<10} {'ms/image':>10} {'KB/image':>10}"]
+    for profile, r in results.items():
+        lines.append(f"{profile:<10} {r['ms']:>10.1f} {r['bytes'] / 1024:>10.1f}")
+    return "\n".join(lines)
+
+# Phone models written to EXIF, with the default photo resolution of their main camera
+PHONE_MODELS = {
+    "Apple":   {"iPhone 13": (4032, 3024), "iPhone 13 Pro": (4032, 3024), "iPhone 14": (4032, 3024),
+                "iPhone 14 Pro": (4032, 3024), "iPhone 15": (5712, 4284)},
+    "Samsung": {"Galaxy S22": (4000, 3000), "Galaxy S23": (4000, 3000), "Galaxy S23 Ultra": (4000, 3000),
+                "Galaxy S24": (4000, 3000)},
+    "Google":  {"Pixel 6": (4080, 3072), "Pixel 7": (4080, 3072), "Pixel 8": (4080, 3072),
+                "Pixel 8 Pro": (4080, 3072)},
+}
+
+def fit_to_resolution(size, resolution):
+    """
+    Returns the size of `size` scaled down to fit a camera `resolution`
+    (long side to long side, so portrait images stay portrait), or `size`
+    itself if it already fits.
+    """
+    w, h = size
+    scale = min(max(resolution) / max(w, h), min(resolution) / min(w, h))
+    if scale >= 1:
+        return size
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+def downscale_to_resolution(img, resolution):
+    """
+    Downscales `img` to fit `resolution`. Large integer factors are taken
+    with the cheap box filter of reduce() first; the rest with LANCZOS.
+    """
+    target = fit_to_resolution(img.size, resolution)
+    if target == img.size:
+        return img
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != target:
+        img = img.resize(target, LANCZOS)
+    return img
+
+def build_exif_bytes(brand, model, photo_datetime):
+    """Builds the EXIF block of a phone photo taken at `photo_datetime`."""
+    date_time_str = photo_datetime.strftime("%Y:%m:%d %H:%M:%S")
+
+    # --- ENHANCED: More authentic metadata ---
+    exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}}
+
+    # 0th IFD
+    exif_dict["0th"][piexif.ImageIFD.Make] = brand.encode('utf-8')
+    exif_dict["0th"][piexif.ImageIFD.Model] = model.encode('utf-8')
+    exif_dict["0th"][piexif.ImageIFD.Software] = "HDR+ 1.0.1234567".encode('utf-8')
+    exif_dict["0th"][piexif.ImageIFD.DateTime] = date_time_str.encode('utf-8')
+
+    # Exif IFD
+    exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = date_time_str.encode('utf-8')
+    exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized] = date_time_str.encode('utf-8')
+    exif_dict["Exif"][piexif.ExifIFD.FNumber] = (random.choice([16, 17, 18]), 10) # F/1.6, F/1.7, etc.
+    exif_dict["Exif"][piexif.ExifIFD.ISOSpeedRatings] = random.choice([50, 64, 80, 100, 125, 200])
+    exif_dict["Exif"][piexif.ExifIFD.Flash] = 16 # Flash did not fire, auto mode
+    exif_dict["Exif"][piexif.ExifIFD.ColorSpace] = 1 # sRGB
+
+    # GPS IFD
+    exif_dict["GPS"] = generate_random_gps()
+
+    return piexif.dump(exif_dict)
+
+def save_with_metadata_and_effects(src_path, dst_path, quality, apply_effects, frame=None, photo_datetime=None,
+                                   encoder_profile="balanced", target_bytes=0, downscale=False,
+                                   frame_selection="first"):
+    """
+    Opens an image, applies optional realism effects, generates rich metadata,
+    and saves it as a new JPEG with specified quality.
+    If `frame` is an already decoded image of `src_path`, it is used instead of
+    decoding the file again. The frame is never modified.
+    `photo_datetime` is the capture time written to EXIF (random time today
+    if not given).
+    `dst_path` may also be a writable file object (e.g. io.BytesIO) to encode
+    into memory. `encoder_profile` is one of ENCODER_PROFILES.
+    With `target_bytes`, the highest quality up to `quality` that stays
+    within that size is used instead of `quality` itself.
+    With `downscale`, images larger than the native resolution of the phone
+    model written to EXIF are scaled down to it before effects and encoding.
+    `frame_selection` picks the frame of animated/multi-page inputs.
+    """
+    brand, models = random.choice(list(PHONE_MODELS.items()))
+    model, resolution = random.choice(list(models.items()))
+
+    # Generate today's datetime with random time for the photo
+    if photo_datetime is None:
+        photo_datetime = generate_todays_datetime()
+
+    if frame is not None and src_path is not None and frame_selection != "first" \
+            and getattr(frame, "n_frames", 1) > 1:
+        frame = None  # The preview frame is the first one; decode the selected one
+    # Without `src_path`, `frame` is a freshly opened image owned by the caller and is seeked directly
+    to_file_object = hasattr(dst_path, "write")
+    with (nullcontext(frame) if frame is not None else Image.open(src_path)) as img, \
+            (nullcontext(dst_path) if to_file_object else atomic_output(dst_path)) as target:
+        if downscale and frame is None:
+            # JPEGs: let the decoder scale by 1/2, 1/4 or 1/8 while it is still large enough
+            img.draft(img.mode, fit_to_resolution(img.size, resolution))
+
+        # Decoding includes conversion to RGB and downscaling (a preview frame is already loaded)
+        with metrics.span("decode"):
+            if metrics.enabled and frame is None and src_path:
+                metrics.add_bytes("read", os.path.getsize(src_path))
+            img = select_frame(img, frame_selection)
+            img.load()
+            orientation = get_orientation(img)
+
+            # Scale down before effects and encoding, which cost per pixel. Modes
+            # Pillow resizes well are scaled before conversion, so it is cheaper
+            if downscale and img.mode in ('RGB', 'RGBA', 'L', 'LA'):
+                img = downscale_to_resolution(img, resolution)
+
+            # Convert to RGB if it has an alpha channel (like PNG) or is greyscale
+            img = to_rgb(img)
+            if downscale:
+                img = downscale_to_resolution(img, resolution)
+        
+        # --- NEW: Apply realism effects ---
+        # Phone photos are often stored sideways with an EXIF orientation. The
+        # output carries no orientation tag, so the pixels are turned upright:
+        # inside the effects' array stage, or with a single transpose without effects
+        with metrics.span("effects"):
+            if apply_effects:
+                img = apply_realism_effects(img, orientation)
+            else:
+                img = apply_orientation(img, orientation)
+
+        with metrics.span("exif"):
+            exif_bytes = build_exif_bytes(brand, model, photo_datetime)
+        
+        # Writing straight to a file path is part of the encode
+        with metrics.span("encode"):
+            if target_bytes:
+                data, used_quality, encodes = size_model.encode(img, target_bytes, encoder_profile, exif_bytes, quality)
+                if len(data) > target_bytes:
+                    print(f"Could not reach {target_bytes // 1024} KB for {src_path or 'image'}; "
+                          f"saved {len(data) // 1024} KB at quality {used_quality}")
+                if to_file_object:
+                    target.write(data)
+                else:
+                    with open(target, "wb") as f:
+                        f.write(data)
+            else:
+                save_jpeg(img, target, exif_bytes, encoder_options(encoder_profile, quality))
+
+# ---------------- Benchmark suite ----------------
+BENCH_SIZES_MP = (1, 12, 48, 100)
+BENCH_MODES = ("RGB", "RGBA", "L")
+BENCH_FORMATS = ("JPEG", "PNG")  # RGBA is only benchmarked as PNG; JPEG has no alpha
+BENCH_STAGES = ("decode", "ingest", "effects", "exif", "encode", "archive", "end_to_end")
+BENCH_BASELINE_FILE = "bench_baseline.json"
+
+def synthetic_image(megapixels, mode):
+    """
+    Creates a 4:3 test image of about `megapixels` MP in `mode`: gradients with
+    a tiled noise texture, so JPEG sizes and encode times resemble photos.
+    """
+    h = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    w = int(h * 4 / 3)
+    rng = np.random.default_rng(0)
+    tile = rng.integers(0, 24, (256, 256), dtype=np.uint8)
+    texture = np.tile(tile, (h // 256 + 1, w // 256 + 1))[:h, :w]
+    x = np.linspace(0, 200, w, dtype=np.float32).astype(np.uint8)
+    y = np.linspace(0, 200, h, dtype=np.float32).astype(np.uint8)
+    channels = [x[None, :] + texture, y[:, None] + texture, ((x[None, :] >> 1) + (y[:, None] >> 1)) + texture]
+    if mode == 'L':
+        return Image.fromarray(channels[0], 'L')
+    if mode == 'RGBA':
+        alpha = np.where(texture > 2, 255, 0).astype(np.uint8)
+        return Image.fromarray(np.dstack(channels + [alpha]), 'RGBA')
+    return Image.fromarray(np.dstack(channels), 'RGB')
+
+def reset_peak_rss():
+    """Resets the peak RSS counter where the OS allows it (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    """
+    Peak resident memory in MB since the last reset_peak_rss(). Falls back to
+    the peak of the whole process where it cannot be reset, and to None where
+    it cannot be measured at all.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def current_rss_mb():
+    """Current resident memory of this process in MB, or None if it cannot be measured."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize / (1024 * 1024)
+        return None
+    return peak_rss_mb()  # macOS and others: the peak is the closest available figure
+
+def _time_runs(repeats, fn):
+    """Runs `fn` `repeats` times; returns ([ms of every run], result of the last run)."""
+    runs, result = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        runs.append((time.perf_counter() - start) * 1000)
+    return runs, result
+
+def _decode(path):
+    with Image.open(path) as img:
+        img.load()
+        return img
+
+def benchmark_case(megapixels, mode, fmt, work_dir, quality=90, repeats=3):
+    """
+    Times every processing stage for one synthetic input and the whole of
+    save_with_metadata_and_effects. Each stage works on the previous stage's
+    output, so only the stage itself is timed. Returns
+    {"megapixels", "ms": {stage: best ms}, "ms_per_mp": {stage: ...},
+    "median_ms_per_mp": {stage: ...}, "peak_rss_mb"}.
+    """
+    src = os.path.join(work_dir, f"src_{megapixels}mp_{mode}.{fmt.lower()}")
+    image = synthetic_image(megapixels, mode)
+    image.save(src, fmt, **({"quality": 95} if fmt == "JPEG" else {"compress_level": 1}))
+    actual_mp = image.width * image.height / 1_000_000
+    del image
+
+    reset_peak_rss()
+    brand, models = next(iter(PHONE_MODELS.items()))
+    model = next(iter(models))
+    photo_datetime = generate_todays_datetime()
+    options = encoder_options("balanced", quality)
+    archive_dst = os.path.join(work_dir, "archive", os.path.basename(src))
+    output_dst = os.path.join(work_dir, "output.jpg")
+    ensure_dir(os.path.dirname(archive_dst))
+
+    runs = {}
+    runs["decode"], img = _time_runs(repeats, lambda: _decode(src))
+    runs["ingest"], img = _time_runs(repeats, lambda: to_rgb(img))
+    runs["effects"], img = _time_runs(repeats, lambda: apply_realism_effects(img))
+    runs["exif"], exif_bytes = _time_runs(repeats, lambda: build_exif_bytes(brand, model, photo_datetime))
+    runs["encode"], _ = _time_runs(repeats, lambda: save_jpeg(img, io.BytesIO(), exif_bytes, options))
+    del img
+    runs["archive"], _ = _time_runs(repeats, lambda: atomic_copy(src, archive_dst))
+    runs["end_to_end"], _ = _time_runs(repeats, lambda: save_with_metadata_and_effects(
+        src, output_dst, quality, True, photo_datetime=photo_datetime))
+    peak = peak_rss_mb()
+    for path in (src, archive_dst, output_dst):
+        os.remove(path)
+    return {
+        "megapixels": round(actual_mp, 2),
+        "ms": {stage: round(min(v), 2) for stage, v in runs.items()},
+        "ms_per_mp": {stage: round(min(v) / actual_mp, 3) for stage, v in runs.items()},
+        "median_ms_per_mp": {stage: round(percentile(v, 50) / actual_mp, 3) for stage, v in runs.items()},
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+    }
+
+def benchmark_pipeline(sizes=BENCH_SIZES_MP, modes=BENCH_MODES, formats=BENCH_FORMATS,
+                       quality=90, repeats=3, progress=print, only=None):
+    """
+    Runs benchmark_case for every size/mode/format combination (with `only`:
+    just the cases named there). Needs no GUI.
+    Returns {"meta": {...}, "cases": {"12MP RGB JPEG": case result, ...}}.
+    """
+    cases = {}
+    with tempfile.TemporaryDirectory(prefix="image_review_bench_") as work_dir:
+        for megapixels in sizes:
+            for mode in modes:
+                for fmt in formats:
+                    if fmt == "JPEG" and mode == "RGBA":
+                        continue
+                    name = f"{megapixels}MP {mode} {fmt}"
+                    if only is not None and name not in only:
+                        continue
+                    if progress:
+                        progress(f"Benchmarking {name}...")
+                    cases[name] = benchmark_case(megapixels, mode, fmt, work_dir, quality, repeats)
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "numpy": np.__version__,
+            "machine": f"{platform.system()} {platform.machine()}",
+            "cpus": os.cpu_count(),
+            "quality": quality,
+        },
+        "cases": cases,
+    }
+
+def compare_to_baseline(results, baseline, threshold=0.2, min_ms=2.0):
+    """
+    Returns a list of regressions: stages whose median ms/MP over the
+    repeats, or cases whose peak RSS, exceed the baseline by more than
+    `threshold` (0.2 = 20%). A single slow run does not move the median.
+    Stages must also be at least `min_ms` slower in absolute terms, so timer
+    noise on sub-millisecond stages (EXIF, ingesting RGB) is not reported.
+    Baselines without medians are compared by the best run. Cases or stages
+    missing from either side are not compared.
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            continue
+        key = "median_ms_per_mp" if "median_ms_per_mp" in base else "ms_per_mp"
+        for stage, value in case[key].items():
+            base_value = base.get(key, {}).get(stage)
+            if not base_value:
+                continue
+            slower_ms = (value - base_value) * case["megapixels"]
+            if value > base_value * (1 + threshold) and slower_ms >= min_ms:
+                regressions.append(f"{name} {stage}: {value:.2f} ms/MP vs baseline {base_value:.2f} "
+                                   f"(+{(value / base_value - 1) * 100:.0f}%)")
+        peak, base_peak = case.get("peak_rss_mb"), base.get("peak_rss_mb")
+        if peak and base_peak and peak > base_peak * (1 + threshold):
+            regressions.append(f"{name} peak RSS: {peak:.0f} MB vs baseline {base_peak:.0f} MB "
+                               f"(+{(peak / base_peak - 1) * 100:.0f}%)")
+    return regressions
+
+def merge_benchmark_cases(first, second):
+    """Combines two measurements of a case, keeping the faster value of every stage (and the lower peak)."""
+    merged = dict(first)
+    for key in ("ms", "ms_per_mp", "median_ms_per_mp"):
+        merged[key] = {stage: min(value, second[key][stage]) for stage, value in first[key].items()}
+    if first["peak_rss_mb"] is not None and second["peak_rss_mb"] is not None:
+        merged["peak_rss_mb"] = min(first["peak_rss_mb"], second["peak_rss_mb"])
+    return merged
+
+def format_benchmark(results):
+    header = f"{'Case':<16}" + "".join(f"{stage:>11}" for stage in BENCH_STAGES) + f"{'peak MB':>9}"
+    lines = ["ms/MP:", header]
+    for name, case in results["cases"].items():
+        peak = case["peak_rss_mb"]
+        lines.append(f"{name:<16}" + "".join(f"{case['ms_per_mp'][stage]:>11.2f}" for stage in BENCH_STAGES)
+                     + (f"{peak:>9.0f}" if peak is not None else f"{'n/a':>9}"))
+    return "\n".join(lines)
+
+class ContainerSink:
+    """
+    Streams files into rolling, uncompressed tar or zip containers through a
+    single writer thread, instead of creating one file per output.
+
+    A container is written as `<name>.part` and renamed once it is full (by
+    size or file count) or the app closes. Every stored member is appended to
+    `container_index.jsonl` next to the containers with its container, member
+    name, header offset and size. Container names include a per-session token,
+    so several processes can write to the same folder without listing it.
+
+    A member already stored for the same source, in a finished container or
+    earlier in this session, is not stored again, so a replayed job does not
+    add a second copy. Members of a container left as `.part` by a crash are
+    stored again.
+    """
+    def __init__(self, folder, kind, max_bytes, max_files):
+        self.folder = folder
+        self.kind = kind
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._prefix = f"{os.path.basename(os.path.normpath(folder))}_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}"
+        self._number = 0
+        self._container = None
+        self._container_name = None
+        self._raw = None
+        self._bytes = 0
+        self._files = 0
+        self._requests = queue.Queue()
+        ensure_dir(folder)
+        self._stored = self._load_stored()  # (member, src) -> 'container/member'
+        self._index = open(os.path.join(folder, CONTAINER_INDEX_FILE), "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _load_stored(self):
+        """Reads the members of finished containers from the index."""
+        containers = {}
+        try:
+            with open(os.path.join(self.folder, CONTAINER_INDEX_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn final record from a crash
+                    containers[(entry["member"], entry["src"])] = entry["container"]
+        except FileNotFoundError:
+            return {}
+        finished = {name for name in set(containers.values()) if os.path.exists(os.path.join(self.folder, name))}
+        return {key: f"{name}/{key[0]}" for key, name in containers.items() if name in finished}
+
+    def write(self, member, data, src=None):
+        """Stores `data` as `member`; blocks until written. Returns 'container/member'."""
+        future = Future()
+        self._requests.put((member, data, src, future))
+        return future.result()
+
+    def _open_container(self):
+        self._container_name = f"{self._prefix}_{self._number:05d}.{self.kind}"
+        self._number += 1
+        path = os.path.join(self.folder, self._container_name + ".part")
+        if self.kind == "tar":
+            self._raw = open(path, "wb")
+            self._container = tarfile.open(fileobj=self._raw, mode="w", format=tarfile.GNU_FORMAT)
+        else:
+            self._container = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._bytes = 0
+        self._files = 0
+
+    def _close_container(self):
+        if self._container is None:
+            return
+        self._container.close()
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+        path = os.path.join(self.folder, self._container_name)
+        os.replace(path + ".part", path)
+        self._container = None
+
+    def _add(self, member, data):
+        """Adds one member and returns its header offset in the container."""
+        if self.kind == "tar":
+            offset = self._container.offset
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._container.addfile(info, io.BytesIO(data))
+            self._raw.flush()  # Members written so far survive a crash
+            return offset
+        info = zipfile.ZipInfo(member, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        self._container.writestr(info, data)
+        return info.header_offset
+
+    def _write_loop(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            member, data, src, future = request
+            if src is not None and (member, src) in self._stored:
+                future.set_result(self._stored[(member, src)])  # Replayed job, stored already
+                continue
+            try:
+                if self._container is None:
+                    self._open_container()
+                offset = self._add(member, data)
+                self._bytes += len(data)
+                self._files += 1
+                self._index.write(json.dumps({
+                    "container": self._container_name, "member": member,
+                    "offset": offset, "size": len(data), "src": src,
+                }) + "\n")
+                self._index.flush()
+                location = f"{self._container_name}/{member}"
+                if src is not None:
+                    self._stored[(member, src)] = location
+                if self._bytes >= self.max_bytes or self._files >= self.max_files:
+                    self._close_container()
+                future.set_result(location)
+            except Exception as e:
+                future.set_exception(e)
+        self._close_container()
+        self._index.close()
+
+    def close(self):
+        self._requests.put(None)
+        self._writer.join()
+
+_container_sinks = {}
+_container_sinks_lock = threading.Lock()
+
+def get_container_sink(folder, kind, max_bytes, max_files):
+    """Returns the shared ContainerSink of a folder, creating it on first use."""
+    key = (os.path.normcase(os.path.abspath(folder)), kind)
+    with _container_sinks_lock:
+        if key not in _container_sinks:
+            _container_sinks[key] = ContainerSink(folder, kind, max_bytes, max_files)
+        return _container_sinks[key]
+
+def close_container_sinks():
+    """Finishes all open containers (renaming them from .part)."""
+    with _container_sinks_lock:
+        for sink in _container_sinks.values():
+            sink.close()
+        _container_sinks.clear()
+
+class WriteBehindWriter:
+    """
+    Write-behind stage between the CPU workers and the disk. Workers hand
+    over finished buffers (or archive copies) and go back to CPU work; a small
+    pool of I/O threads does the actual writing.
+
+    - `io_workers` threads write concurrently; each takes every request that
+      is waiting (up to COALESCE) and writes them in path order, so writes to
+      the same folder go out back to back.
+    - At most `max_pending_bytes` may wait in memory; beyond that `submit_*`
+      blocks the calling worker (backpressure).
+    - With `fadvise`, sources are read with a sequential hint and written
+      files are dropped from the page cache (POSIX only).
+    - Bytes and busy time are tracked per device (st_dev), see `stats`.
+    """
+    COALESCE = 32
+
+    def __init__(self, io_workers=2, max_pending_bytes=512 * 1024 * 1024, fadvise=False):
+        self.max_pending_bytes = max_pending_bytes
+        self.fadvise = fadvise and hasattr(os, "posix_fadvise")
+        self._requests = queue.Queue()
+        self._pending_bytes = 0
+        self._pending_cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._device_stats = {}  # st_dev -> [bytes, busy seconds, files]
+        self._folder_devices = {}
+        self._threads = [threading.Thread(target=self._io_loop, daemon=True) for _ in range(max(1, io_workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit_write(self, path, data):
+        """Queues writing `data` to `path` (atomically). Returns a Future."""
+        return self._submit(("write", path, data), len(data))
+
+    def submit_copy(self, src_path, dst_path):
+        """Queues copying `src_path` to `dst_path` (atomically). Returns a Future."""
+        return self._submit(("copy", dst_path, src_path), 0)
+
+    def _submit(self, request, nbytes):
+        with self._pending_cond:
+            # A single buffer larger than the limit is still let through alone
+            while self._pending_bytes and self._pending_bytes + nbytes > self.max_pending_bytes:
+                self._pending_cond.wait()
+            self._pending_bytes += nbytes
+        future = Future()
+        self._requests.put((request, nbytes, future, metrics.current()))
+        return future
+
+    @staticmethod
+    def when_all(futures, on_success):
+        """Returns a Future resolving to on_success() once all `futures` succeeded."""
+        combined = Future()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(future):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if not last:
+                return
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                combined.set_exception(errors[0])
+                return
+            try:
+                combined.set_result(on_success())
+            except Exception as e:
+                combined.set_exception(e)
+
+        for future in futures:
+            future.add_done_callback(done)
+        return combined
+
+    def _io_loop(self):
+        stop = False
+        while not stop:
+            # Take whatever is waiting, but only one stop marker per thread
+            batch = []
+            item = self._requests.get()
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.COALESCE:
+                    break
+                try:
+                    item = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+            batch.sort(key=lambda item: item[0][1])
+            for request, nbytes, future, record in batch:
+                try:
+                    with metrics.span("write" if request[0] == "write" else "archive", record):
+                        self._perform(request, record)
+                    future.set_result(request[1])
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    with self._pending_cond:
+                        self._pending_bytes -= nbytes
+                        self._pending_cond.notify_all()
+
+    def _perform(self, request, record=None):
+        dst_path = request[1]
+        start = time.perf_counter()
+        nbytes = write_in_dir(os.path.dirname(dst_path), lambda: self._write(request, record))
+        metrics.add_bytes("written", nbytes, record)
+        self._account(os.path.dirname(dst_path), nbytes, time.perf_counter() - start)
+
+    def _write(self, request, record):
+        kind, dst_path, payload = request
+        with atomic_output(dst_path) as tmp_path:
+            if kind == "write":
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                    self._drop_cache(f)
+                nbytes = len(payload)
+            else:
+                with open(payload, "rb") as src:
+                    if self.fadvise:
+                        os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    with open(tmp_path, "wb") as f:
+                        shutil.copyfileobj(src, f, 1024 * 1024)
+                        nbytes = f.tell()
+                        self._drop_cache(f)
+                shutil.copystat(payload, tmp_path)
+                metrics.add_bytes("read", nbytes, record)
+        return nbytes
+
+    def _drop_cache(self, f):
+        if self.fadvise:
+            f.flush()
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def _account(self, folder, nbytes, seconds):
+        device = self._folder_devices.get(folder)
+        if device is None:
+            device = self._folder_devices[folder] = os.stat(folder).st_dev
+        with self._stats_lock:
+            entry = self._device_stats.setdefault(device, [0, 0.0, 0])
+            entry[0] += nbytes
+            entry[1] += seconds
+            entry[2] += 1
+
+    def stats(self):
+        """Returns {device: {"bytes", "files", "mb_per_s"}} with throughput over busy time."""
+        with self._stats_lock:
+            return {
+                device: {"bytes": b, "files": n, "mb_per_s": (b / 1e6 / busy) if busy else 0.0}
+                for device, (b, busy, n) in self._device_stats.items()
+            }
+
+    def format_stats(self):
+        parts = [f"dev {device}: {s['mb_per_s']:.1f} MB/s ({s['files']} files)" for device, s in self.stats().items()]
+        return "; ".join(parts)
+
+    def close(self):
+        """Writes everything still queued, then stops the I/O threads."""
+        for _ in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+
+def process_job(job, frame=None, writer=None):
+    """
+    Runs one keep/modify job: archives the original and saves the processed
+    version. All settings come from the job itself (snapshotted when the key
+    was pressed), so this is safe to run in any thread, or again on replay.
+    Returns the output path.
+
+    With a `writer` (WriteBehindWriter) and the "files" sink, only the CPU
+    work happens here: the image is encoded into memory, both writes are
+    queued, and a Future of the output path is returned instead.
+    """
+    src_path = job["src"]
+    shard = job.get("shard", "")
+    settings = job["settings"]
+    sink = settings.get("output_sink", "files")
+    subfolder_root = os.path.join(job["base_out"], job["subfolder"])
+    archive_root = os.path.join(job["base_out"], "archive")
+    photo_datetime = datetime.fromisoformat(job["photo_datetime"]) if job.get("photo_datetime") else None
+    original = None  # Source bytes, when they are read into memory anyway
+
+    if sink == "files":
+        output_folder = os.path.join(subfolder_root, *shard.split("/"))
+        archive_folder = os.path.join(archive_root, *shard.split("/"))
+        ensure_dir(output_folder)
+        ensure_dir(archive_folder)
+
+        archive_dst = os.path.join(archive_folder, os.path.basename(src_path))
+        output_dst = os.path.join(output_folder, job["output_name"])
+        output_location = os.path.relpath(output_dst, subfolder_root).replace(os.sep, "/")
+        archive_location = os.path.relpath(archive_dst, job["base_out"]).replace(os.sep, "/")
+
+        if writer is not None:
+            archive_done = writer.submit_copy(src_path, archive_dst)
+            buffer = io.BytesIO()
+            save_with_settings(src_path, buffer, settings, frame=frame, photo_datetime=photo_datetime)
+            output_done = writer.submit_write(output_dst, buffer.getvalue())
+            return writer.when_all(
+                [archive_done, output_done],
+                lambda: _record_job_output(job, subfolder_root, output_dst, output_location, archive_location),
+            )
+
+        # 1. Archive the original image (lossless copy)
+        with metrics.span("archive"):
+            write_in_dir(archive_folder, lambda: atomic_copy(src_path, archive_dst))
+        if metrics.enabled:
+            size = os.path.getsize(archive_dst)
+            metrics.add_bytes("read", size)
+            metrics.add_bytes("written", size)
+
+        # 2. Process and save the modified version
+        write_in_dir(output_folder, lambda: save_with_settings(src_path, output_dst, settings, frame=frame,
+                                                               photo_datetime=photo_datetime))
+        if metrics.enabled:
+            metrics.add_bytes("written", os.path.getsize(output_dst))
+    else:
+        # Same steps, but both streams go into containers instead of single files
+        max_bytes = settings.get("container_max_mb", 2048) * 1024 * 1024
+        max_files = settings.get("container_max_files", 20000)
+        prefix = f"{shard}/" if shard else ""
+
+        with metrics.span("archive"):
+            with open(src_path, "rb") as f:
+                original = f.read()
+            archive_sink = get_container_sink(archive_root, sink, max_bytes, max_files)
+            archive_location = "archive/" + archive_sink.write(prefix + os.path.basename(src_path), original, src_path)
+        metrics.add_bytes("read", len(original))
+        metrics.add_bytes("written", len(original))
+
+        buffer = io.BytesIO()
+        save_with_settings(src_path, buffer, settings, frame=frame, photo_datetime=photo_datetime)
+        output_sink = get_container_sink(subfolder_root, sink, max_bytes, max_files)
+        with metrics.span("write"):
+            output_location = output_sink.write(prefix + job["output_name"], buffer.getvalue(), src_path)
+        metrics.add_bytes("written", buffer.tell())
+        output_dst = os.path.join(subfolder_root, output_location)
+
+    return _record_job_output(job, subfolder_root, output_dst, output_location, archive_location, original)
+
+def _record_job_output(job, subfolder_root, output_dst, output_location, archive_location, data=None):
+    manifest_writer.append(subfolder_root, {
+        "src": job["src"],
+        "output": output_location,
+        "archive": archive_location,
+        "time": time.time(),
+    })
+    index = get_processed_index()
+    if index is not None:
+        try:
+            index.add(job["src"], output_dst, os.path.basename(subfolder_root), data)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not record {job['src']} as processed: {e}")
+    return output_dst
+
+class JobJournal:
+    """
+    Append-only write-ahead journal of processing jobs. A "submit" record is
+    written for every job when it is queued and a "finish" record when it is
+    done; jobs without a finish record are replayed on the next start.
+
+    Records are appended by a writer thread that fsyncs once per batch: all
+    records queued while the previous fsync was running go out together.
+    """
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._records = queue.Queue()
+        self._file = None
+        self._writer = None
+
+    def recover(self):
+        """
+        Reads the journal left by the previous run and returns its unfinished
+        jobs. The journal is rewritten to hold only those, then opened for
+        appending. Must be called once before submitting new jobs.
+        """
+        jobs = OrderedDict()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn final record from a crash
+                    if record["op"] == "submit":
+                        jobs[record["job"]["id"]] = record["job"]
+                    elif record["op"] == "finish":
+                        jobs.pop(record["id"], None)
+
+        with atomic_output(self.path) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for job in jobs.values():
+                    f.write(json.dumps({"op": "submit", "job": job}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        return list(jobs.values())
+
+    def submit(self, job):
+        self._records.put({"op": "submit", "job": job})
+
+    def finish(self, job_id, status):
+        self._records.put({"op": "finish", "id": job_id, "status": status})
+
+    def _write_loop(self):
+        closing = False
+        while not closing:
+            batch = [self._records.get()]
+            while True:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = [r for r in batch if r is not None]
+            try:
+                for record in batch:
+                    self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                print(f"!!! Could not write job journal: {e}")
+
+    def close(self, all_finished=False):
+        """Flushes the journal. If every job finished, it is emptied."""
+        if self._writer is None:
+            return
+        self._records.put(None)
+        self._writer.join()
+        self._file.close()
+        self._writer = None
+        if all_finished:
+            open(self.path, "w").close()
+
+
+class AsyncIOEngine:
+    """
+    asyncio-based I/O for folders on network storage (NFS/SMB), where the
+    latency of each file operation, not bandwidth, is the limit. Listing,
+    reading and writing run as coroutines with up to `max_in_flight`
+    operations outstanding at once; the blocking system calls themselves run
+    on a matching thread pool. CPU-bound work is not done here, callers hand
+    it to their own executor.
+
+    `latency` (seconds) is added to every operation to simulate a network
+    mount against a local folder.
+    """
+    def __init__(self, max_in_flight=64, latency=0.0):
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="aio")
+        self._semaphore = None
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self._semaphore:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def list_images(self, folder, max_depth=0):
+        """Lists image files, scanning all subfolders of one level concurrently."""
+        def scan(path):
+            files, dirs = [], []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                                files.append(entry.path)
+                        elif entry.name not in OUTPUT_SUBFOLDERS and entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+                    except OSError:
+                        continue
+            return files, dirs
+
+        found = []
+        level = [folder]
+        for depth in range(max_depth + 1):
+            results = await asyncio.gather(*(self._run(scan, path) for path in level), return_exceptions=True)
+            level = []
+            for result in results:
+                if isinstance(result, Exception):
+                    if depth == 0:
+                        raise result
+                    print(f"Skipping unreadable folder: {result}")
+                    continue
+                files, dirs = result
+                found.extend(files)
+                level.extend(dirs)
+            if not level:
+                break
+        return sorted(found)
+
+    async def read_file(self, path):
+        def read():
+            with open(path, "rb") as f:
+                return f.read()
+        return await self._run(read)
+
+    async def write_file(self, path, data):
+        """Writes `data` atomically (temp file + rename)."""
+        def write():
+            with atomic_output(path) as tmp_path:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+
+        def write_new():
+            ensure_dir(os.path.dirname(path))
+            write_in_dir(os.path.dirname(path), write)
+        await self._run(write_new)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+class AsyncWriteBehindWriter:
+    """
+    Same interface as WriteBehindWriter, backed by an AsyncIOEngine running
+    on its own event loop thread (io_engine = "asyncio"). Suited to network
+    output folders: many writes are in flight at once instead of a few
+    blocking threads.
+    """
+    def __init__(self, max_in_flight=64, latency=0.0):
+        self.engine = AsyncIOEngine(max_in_flight, latency)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        # Backpressure: workers block once this many operations are queued
+        self._slots = threading.BoundedSemaphore(max_in_flight * 4)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._files = 0
+        self._bytes = 0
+
+    when_all = staticmethod(WriteBehindWriter.when_all)
+
+    def submit_write(self, path, data):
+        record = metrics.current()
+
+        async def write():
+            with metrics.span("write", record):
+                await self.engine.write_file(path, data)
+            metrics.add_bytes("written", len(data), record)
+        return self._submit(write(), len(data))
+
+    def submit_copy(self, src_path, dst_path):
+        record = metrics.current()
+
+        async def copy():
+            with metrics.span("archive", record):
+                data = await self.engine.read_file(src_path)
+                await self.engine.write_file(dst_path, data)
+            metrics.add_bytes("read", len(data), record)
+            metrics.add_bytes("written", len(data), record)
+            return len(data)
+        return self._submit(copy(), None)
+
+    def _submit(self, coro, nbytes):
+        self._slots.acquire()
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        with self._pending_lock:
+            self._pending.add(future)
+
+        def done(f):
+            self._slots.release()
+            with self._pending_lock:
+                self._pending.discard(f)
+                if f.exception() is None:
+                    self._files += 1
+                    self._bytes += nbytes if nbytes is not None else f.result()
+        future.add_done_callback(done)
+        return future
+
+    def stats(self):
+        return {"async": {"bytes": self._bytes, "files": self._files}} if self._files else {}
+
+    def format_stats(self):
+        return f"asyncio: {self._bytes / 1e6:.1f} MB ({self._files} files)" if self._files else ""
+
+    def close(self):
+        with self._pending_lock:
+            pending = list(self._pending)
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                pass  # Already reported through the job's callback
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self.engine.close()
+
+def run_batch(folder, subfolder="keep", base_out=None, settings=None, max_depth=0,
+              max_in_flight=64, latency=0.0, cpu_workers=None, skip_processed=False):
+    """
+    Headless batch path: processes every image in `folder` as if it had been
+    kept (or sent to `subfolder`), without the GUI. Sources are read and
+    outputs written through an AsyncIOEngine; decoding, effects and encoding
+    run on a thread pool. With `skip_processed`, sources found in the
+    ProcessedIndex are left out. Returns (processed, failed).
+    """
+    config = load_config()
+    if settings is None:
+        settings = {"quality": config["jpeg_quality"], "apply_effects": config["apply_realism_effects"],
+                    "encoder_profile": config["encoder_profile"], "target_size_kb": config["target_size_kb"],
+                    "downscale_to_device": config["downscale_to_device"],
+                    "frame_selection": config["frame_selection"]}
+    base_out = base_out or folder
+    subfolder_root = os.path.join(base_out, subfolder)
+    allocator = get_name_allocator(subfolder_root)
+    engine = AsyncIOEngine(max_in_flight, latency)
+    cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers or os.cpu_count())
+
+    def encode(data, photo_datetime, record):
+        metrics.attach(record)
+        try:
+            buffer = io.BytesIO()
+            with profiler.task(), Image.open(io.BytesIO(data)) as img:
+                save_with_settings(None, buffer, settings, frame=img, photo_datetime=photo_datetime)
+            return buffer.getvalue()
+        finally:
+            metrics.attach(None)
+
+    async def timed_write(stage, path, data, record):
+        with metrics.span(stage, record):
+            await engine.write_file(path, data)
+        metrics.add_bytes("written", len(data), record)
+
+    async def process(path, jobs_in_flight, counts):
+        async with jobs_in_flight:
+            record = metrics.begin_job({"id": uuid.uuid4().hex, "src": path, "subfolder": subfolder})
+            metrics.attach(None)  # Records are passed explicitly on the event loop thread
+            try:
+                photo_datetime, output_name, seq = allocator.allocate()
+                shard = output_shard(config["output_layout"], output_name, photo_datetime, seq,
+                                     config["output_shard_size"])
+                output_dst = os.path.join(subfolder_root, *shard.split("/"), output_name)
+                archive_dst = os.path.join(base_out, "archive", *shard.split("/"), os.path.basename(path))
+
+                data = await engine.read_file(path)
+                metrics.add_bytes("read", len(data), record)
+                encoded = await asyncio.get_running_loop().run_in_executor(
+                    cpu_pool, encode, data, photo_datetime, record)
+                await asyncio.gather(timed_write("archive", archive_dst, data, record),
+                                     timed_write("write", output_dst, encoded, record))
+                _record_job_output({"src": path}, subfolder_root, output_dst,
+                                   os.path.relpath(output_dst, subfolder_root).replace(os.sep, "/"),
+                                   os.path.relpath(archive_dst, base_out).replace(os.sep, "/"), data)
+                metrics.end_job(record, "done", output=output_dst)
+                counts[0] += 1
+            except Exception as e:
+                print(f"!!! FAILED to process {os.path.basename(path)}: {e}")
+                metrics.end_job(record, "failed", error=e)
+                counts[1] += 1
+
+    async def run():
+        paths = await engine.list_images(folder, max_depth)
+        index = get_processed_index() if skip_processed else None
+        if index is not None:
+            started = time.perf_counter()
+            done = await asyncio.get_running_loop().run_in_executor(cpu_pool, index.lookup, paths)
+            paths = [path for path in paths if path not in done]
+            print(f"Skipping {len(done)} image(s) processed before (checked in {time.perf_counter() - started:.1f}s)")
+        print(f"Processing {len(paths)} image(s) from {folder}...")
+        # Bounds how many decoded images/buffers are held at once
+        jobs_in_flight = asyncio.Semaphore((cpu_workers or os.cpu_count()) * 4)
+        counts = [0, 0]
+        await asyncio.gather(*(process(path, jobs_in_flight, counts) for path in paths))
+        return tuple(counts)
+
+    start = time.perf_counter()
+    try:
+        processed, failed = asyncio.run(run())
+    finally:
+        cpu_pool.shutdown(wait=True)
+        engine.close()
+        manifest_writer.close()
+        close_processed_index()
+        metrics.close()
+    print(f"Done: {processed} processed, {failed} failed in {time.perf_counter() - start:.1f}s")
+    return processed, failed
+
+# ---------------- Job spool ----------------
+SPOOL_STATES = ("pending", "claimed", "done", "failed")
+SPOOL_POLL_INTERVAL = 1.0  # Seconds between looks into the spool while idle
+SPOOL_HEARTBEAT = 10.0  # Seconds between touches of a claimed job while it runs
+SPOOL_CLAIM_TIMEOUT = 60.0  # A claim not touched for this long belongs to a dead worker
+
+class JobSpool:
+    """
+    Shared directory through which the reviewer hands keep/modify jobs to
+    worker processes, possibly on other machines:
+
+        pending/<seq>_<id>.json   job manifest, written atomically by the reviewer
+        claimed/<seq>_<id>.json   moved here by the worker that took the job
+        done/<id>.json            the job plus its outcome, written by the worker
+        failed/<id>.json          the same, for jobs that raised
+
+    A job is claimed by renaming it from pending/ to claimed/, which only one
+    worker can do. Workers touch their claimed files while the jobs run, and
+    claims that were not touched for SPOOL_CLAIM_TIMEOUT are moved back to
+    pending/. Jobs can safely run twice (output names are fixed when the key
+    is pressed and files are written atomically), so a worker that was only
+    slow costs some time, but no duplicate output files. With a container
+    sink, both workers may store the job's members in their own containers.
+    """
+    def __init__(self, root):
+        self.root = root
+        for state in SPOOL_STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    def _dir(self, state):
+        return os.path.join(self.root, state)
+
+    def submit(self, job):
+        # The time prefix makes workers take jobs in submission order
+        with atomic_output(os.path.join(self._dir("pending"), f"{time.time_ns()}_{job['id']}.json")) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(job, f)
+
+    def claim(self):
+        """Claims the oldest pending job. Returns (claim name, job), or None if nothing is pending."""
+        for name in sorted(os.listdir(self._dir("pending"))):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue  # Still being written
+            claimed = os.path.join(self._dir("claimed"), name)
+            try:
+                os.rename(os.path.join(self._dir("pending"), name), claimed)
+            except FileNotFoundError:
+                continue  # Another worker was faster
+            os.utime(claimed)  # rename keeps the submit time; the claim's clock starts now
+            with open(claimed, "r", encoding="utf-8") as f:
+                return name, json.load(f)
+        return None
+
+    def heartbeat(self, name):
+        try:
+            os.utime(os.path.join(self._dir("claimed"), name))
+        except FileNotFoundError:
+            pass  # Reclaimed after all; the job will run once more elsewhere
+
+    def finish(self, name, job, status, output=None, error=None, worker=""):
+        """Publishes the outcome of a claimed job ('done' or 'failed') and drops the claim."""
+        result = dict(job, status=status, output=output, error=error, worker=worker, finished=time.time())
+        with atomic_output(os.path.join(self._dir(status), f"{job['id']}.json")) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+        try:
+            os.remove(os.path.join(self._dir("claimed"), name))
+        except FileNotFoundError:
+            pass
+
+    def reclaim_stale(self, timeout=SPOOL_CLAIM_TIMEOUT):
+        """Moves claims nobody touched for `timeout` seconds back to pending/. Returns how many."""
+        reclaimed = 0
+        now = time.time()
+        with os.scandir(self._dir("claimed")) as entries:
+            for entry in entries:
+                try:
+                    if entry.name.endswith(".json") and now - entry.stat().st_mtime > timeout:
+                        os.rename(entry.path, os.path.join(self._dir("pending"), entry.name))
+                        reclaimed += 1
+                except FileNotFoundError:
+                    pass  # Finished or reclaimed in the meantime
+        return reclaimed
+
+    def queued_ids(self):
+        """Returns the ids of all jobs that are pending or claimed."""
+        ids = set()
+        for state in ("pending", "claimed"):
+            for name in os.listdir(self._dir(state)):
+                if not name.startswith(".") and name.endswith(".json"):
+                    ids.add(name[:-len(".json")].split("_", 1)[-1])
+        return ids
+
+    def finished_ids(self):
+        """Returns {job id: 'done' or 'failed'} for every finished job, from one listing per state."""
+        finished = {}
+        for state in ("failed", "done"):  # A job that failed once and then succeeded counts as done
+            for name in os.listdir(self._dir(state)):
+                if not name.startswith(".") and name.endswith(".json"):
+                    finished[name[:-len(".json")]] = state
+        return finished
+
+    def read_result(self, job_id, state):
+        """Returns the outcome record of a job listed by finished_ids."""
+        with open(os.path.join(self._dir(state), f"{job_id}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+class SpoolClient(threading.Thread):
     """
-    # Ensure we are working with an RGB image
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-        
-    # 1. Luminance-Dependent Noise
-    np_img = np.array(img).astype(np.float32)
-    
-    # Create a grayscale version to determine brightness (0=black, 255=white)
-    luminance = np.array(img.convert('L')).astype(np.float32)
-    
-    # Create a "noise mask": Brighter areas get a smaller multiplier, darker areas get a larger one.
-    # We invert luminance (255 - lum) so dark areas have high values.
-    # The strength factor (e.g., / 255.0 * 4.0) controls the max noise intensity.
-    noise_strength_mask = (255.0 - luminance) / 255.0 * 3.5  # Max noise factor of 3.5 in pure black
-    noise_strength_mask = np.expand_dims(noise_strength_mask, axis=-1) # Match shape for broadcasting
-    
-    # Generate standard noise and scale it by our mask
-    noise = np.random.normal(0, 1, np_img.shape)
-    scaled_noise = noise * noise_strength_mask
+    The reviewer's side of a JobSpool, on a thread of its own, so no
+    keypress waits for the shared drive. Jobs handed to `submit` are written
+    to pending/ in order, and their outcomes are looked for by listing done/
+    and failed/ once per SPOOL_POLL_INTERVAL (only while jobs are
+    outstanding). `watch` adds jobs submitted by an earlier session. Results
+    go to `results` for the Tk thread:
 
-    # Add the scaled noise to the image and clip to valid range
-    np_img = np.clip(np_img + scaled_noise, 0, 255)
-    img = Image.fromarray(np_img.astype(np.uint8), 'RGB')
+        ("finished", job id, outcome record)
+        ("unsent", job, error)     the job could not be written to the spool
 
+    `stop` returns once every submitted job is written.
+    """
+    _STOP = object()
 
-    # 2. Simulate subtle chromatic aberration with blending for a weaker effect
-    r, g, b = img.split()
-    offset = 1 # Shift by 1 pixel
+    def __init__(self, spool):
+        super().__init__(daemon=True)
+        self.spool = spool
+        self.results = queue.Queue()
+        self._jobs = queue.Queue()
+        self._watched = set()  # Only used on this thread
 
-    # Create empty channels for shifted Red and Blue
-    r_shifted = Image.new('L', img.size)
-    b_shifted = Image.new('L', img.size)
-    
-    # Paste the original channels with an offset
-    r_shifted.paste(r, (-offset, 0))
-    b_shifted.paste(b, (offset, 0))
+    def submit(self, job):
+        self._jobs.put(job)
 
-    # Blend the shifted channels with the originals to make the effect subtle
-    # Reduced alpha from 0.4 to 0.2 for weaker chromatic aberration
-    blend_alpha = 0.2 
-    r_final = Image.blend(r, r_shifted, alpha=blend_alpha)
-    b_final = Image.blend(b, b_shifted, alpha=blend_alpha)
+    def watch(self, job_id):
+        self._jobs.put(job_id)
 
-    # Merge the final channels
-    img = Image.merge('RGB', (r_final, g, b_final))
+    def stop(self):
+        self._jobs.put(self._STOP)
+        self.join()
 
-    return img
+    def run(self):
+        last_poll = time.monotonic()
+        while True:
+            try:
+                item = self._jobs.get(timeout=max(0.0, last_poll + SPOOL_POLL_INTERVAL - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                break
+            if isinstance(item, str):
+                self._watched.add(item)
+            elif item is not None:
+                try:
+                    self.spool.submit(item)
+                except OSError as e:
+                    self.results.put(("unsent", item, e))
+                else:
+                    self._watched.add(item["id"])
+            if time.monotonic() - last_poll >= SPOOL_POLL_INTERVAL:
+                self._poll()
+                last_poll = time.monotonic()
+
+    def _poll(self):
+        if not self._watched:
+            return
+        try:
+            finished = self.spool.finished_ids()
+        except OSError:
+            return  # Retried on the next poll
+        for job_id in self._watched & finished.keys():
+            try:
+                result = self.spool.read_result(job_id, finished[job_id])
+            except (OSError, ValueError):
+                continue
+            self._watched.discard(job_id)
+            self.results.put(("finished", job_id, result))
 
-def save_with_metadata_and_effects(src_path, dst_path, quality, apply_effects):
+def run_spool_worker(spool_dir, threads=None, exit_when_idle=False):
     """
-    Opens an image, applies optional realism effects, generates rich metadata,
-    and saves it as a new JPEG with specified quality.
+    Headless worker: claims jobs from the JobSpool in `spool_dir` and runs
+    them with process_job until interrupted (with `exit_when_idle`: until
+    nothing is pending or running). Only as many jobs are claimed as there
+    are free threads, so the rest stays available to other workers.
+    Returns (done, failed).
     """
-    phone_brands = [
-        ("Apple",   ["iPhone 13", "iPhone 13 Pro", "iPhone 14", "iPhone 14 Pro", "iPhone 15"]),
-        ("Samsung", ["Galaxy S22", "Galaxy S23", "Galaxy S23 Ultra", "Galaxy S24"]),
-        ("Google",  ["Pixel 6", "Pixel 7", "Pixel 8", "Pixel 8 Pro"]),
-    ]
-    brand, models = random.choice(phone_brands)
-    model = random.choice(models)
+    spool = JobSpool(spool_dir)
+    worker = f"{platform.node()}:{os.getpid()}"
+    threads = threads or os.cpu_count()
+    pool = ThreadPoolExecutor(max_workers=threads)
+    running = {}  # Claim name -> Future of "done"/"failed"
+    counts = {"done": 0, "failed": 0}
 
-    # Generate today's datetime with random time for the photo
-    photo_datetime = generate_todays_datetime()
-    date_time_str = photo_datetime.strftime("%Y:%m:%d %H:%M:%S")
+    def run(name, job):
+        record = metrics.begin_job(job)
+        try:
+            with profiler.task():
+                output = process_job(job)
+        except Exception as e:
+            print(f"!!! FAILED to process {os.path.basename(job['src'])}: {e}")
+            metrics.end_job(record, "failed", error=e)
+            spool.finish(name, job, "failed", error=str(e), worker=worker)
+            return "failed"
+        finally:
+            metrics.attach(None)
+        if not metrics.logs_jobs:
+            print(f"Successfully processed and saved to {output}")
+        metrics.end_job(record, "done", output=output)
+        spool.finish(name, job, "done", output=output, worker=worker)
+        return "done"
 
-    with Image.open(src_path) as img:
-        # Convert to RGB if it has an alpha channel (like PNG) or is greyscale
-        if img.mode not in ('RGB'):
-            img = img.convert('RGB')
-        
-        # --- NEW: Apply realism effects ---
-        if apply_effects:
-            img = apply_realism_effects(img)
+    print(f"Worker {worker} taking jobs from {spool_dir} with {threads} thread(s)...")
+    last_heartbeat = last_reclaim = 0.0
+    try:
+        while True:
+            for name in [name for name, future in running.items() if future.done()]:
+                counts[running.pop(name).result()] += 1
+            now = time.monotonic()
+            if now - last_heartbeat >= SPOOL_HEARTBEAT:
+                for name in running:
+                    spool.heartbeat(name)
+                last_heartbeat = now
+            if now - last_reclaim >= SPOOL_CLAIM_TIMEOUT / 2:
+                reclaimed = spool.reclaim_stale()
+                if reclaimed:
+                    print(f"Moved {reclaimed} job(s) of stopped workers back to pending")
+                last_reclaim = now
+            claimed = spool.claim() if len(running) < threads else None
+            if claimed:
+                running[claimed[0]] = pool.submit(run, *claimed)
+                continue
+            if exit_when_idle and not running:
+                break
+            time.sleep(0.05 if running else SPOOL_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        print(f"Stopping after the {len(running)} job(s) already claimed...")
+    finally:
+        pool.shutdown(wait=True)
+        for future in running.values():
+            counts[future.result()] += 1
+        close_container_sinks()
+        manifest_writer.close()
+        close_processed_index()
+        metrics.close()
+    print(f"Worker {worker}: {counts['done']} done, {counts['failed']} failed")
+    return counts["done"], counts["failed"]
 
-        # --- ENHANCED: More authentic metadata ---
-        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}}
-        
-        # 0th IFD
-        exif_dict["0th"][piexif.ImageIFD.Make] = brand.encode('utf-8')
-        exif_dict["0th"][piexif.ImageIFD.Model] = model.encode('utf-8')
-        exif_dict["0th"][piexif.ImageIFD.Software] = "HDR+ 1.0.1234567".encode('utf-8')
-        exif_dict["0th"][piexif.ImageIFD.DateTime] = date_time_str.encode('utf-8')
-
-        # Exif IFD
-        exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = date_time_str.encode('utf-8')
-        exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized] = date_time_str.encode('utf-8')
-        exif_dict["Exif"][piexif.ExifIFD.FNumber] = (random.choice([16, 17, 18]), 10) # F/1.6, F/1.7, etc.
-        exif_dict["Exif"][piexif.ExifIFD.ISOSpeedRatings] = random.choice([50, 64, 80, 100, 125, 200])
-        exif_dict["Exif"][piexif.ExifIFD.Flash] = 16 # Flash did not fire, auto mode
-        exif_dict["Exif"][piexif.ExifIFD.ColorSpace] = 1 # sRGB
-
-        # GPS IFD
-        exif_dict["GPS"] = generate_random_gps()
-        
-        exif_bytes = piexif.dump(exif_dict)
-        
-        # --- MODIFIED: Use quality slider and add chroma subsampling for authenticity ---
-        subsampling = '4:2:0' if quality < 90 else '4:4:4'
-        img.save(dst_path, "jpeg", exif=exif_bytes, quality=quality, subsampling=subsampling)
+# ---------------- Startup ----------------
+STARTUP_DEFERRED_MS = 100  # Delay after the window is created before deferred startup work
+
+startup_timings = {}
+
+def warm_up_processing():
+    """
+    Imports numpy and piexif and runs the effects and EXIF code once on a
+    tiny image, so the first keep/modify does not pay for it.
+    """
+    start = time.perf_counter()
+    np.load()
+    piexif.load()
+    apply_realism_effects(Image.new('RGB', (16, 16)))
+    build_exif_bytes("Apple", "iPhone 15", datetime.now())
+    startup_timings["warm_up_ms"] = (time.perf_counter() - start) * 1000
+
+def _startup_probe(folder, real_display):
+    """
+    Runs in a fresh process for benchmark_startup: opens the reviewer on
+    `folder` and prints time stamps (time.time()) as one JSON line.
+    """
+    stamps = {"imported": time.time()}
+    module = sys.modules[__name__] if real_display else load_headless_reviewer_module()
+    app = module.ImageReviewer()
+    app.update()
+    stamps["window"] = time.time()
+    app.load_images(folder)
+    deadline = time.time() + 60
+    while app.current_img is None and time.time() < deadline:
+        app.update()
+        time.sleep(0.001)
+    if real_display:
+        app.update_idletasks()
+    stamps["image"] = time.time()
+    stamps["numpy_before_first_image"] = "numpy" in sys.modules
+    while "warm_up_ms" not in module.startup_timings and time.time() < deadline:
+        app.update()
+        time.sleep(0.01)
+    stamps["warm_up_ms"] = module.startup_timings.get("warm_up_ms", 0.0)
+    print(json.dumps(stamps))
+    app.on_closing()
+
+def benchmark_startup(runs=5, real_display=False, megapixels=12):
+    """
+    Starts the app `runs` times in fresh processes and returns the median
+    ms from process start to: module imported, window created, first image
+    shown; plus the background warm-up time. Frozen builds start themselves,
+    so this also measures a PyInstaller build.
+    """
+    if getattr(sys, "frozen", False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, os.path.abspath(__file__)]
+    results = {"imported": [], "window": [], "image": [], "warm_up": []}
+    with tempfile.TemporaryDirectory(prefix="image_review_startup_") as work_dir:
+        folder = os.path.join(work_dir, "images")
+        os.makedirs(folder)
+        synthetic_image(megapixels, 'RGB').save(os.path.join(folder, "IMG_0000.jpg"), "JPEG", quality=90)
+        probe = command + ["--startup-probe", folder] + (["--sim-display"] if real_display else [])
+        for _ in range(runs):
+            started = time.time()
+            output = subprocess.run(probe, cwd=work_dir, capture_output=True, text=True, check=True).stdout
+            stamps = json.loads(next(line for line in output.splitlines() if line.startswith("{")))
+            for key in ("imported", "window", "image"):
+                results[key].append((stamps[key] - started) * 1000)
+            results["warm_up"].append(stamps["warm_up_ms"])
+    return {key: percentile(values, 50) for key, values in results.items()}
 
+HUD_INTERVAL_MS = 1000  # Refresh period of the performance HUD
+HUD_WINDOW = 10  # HUD refreshes that images/s and stage averages are computed over
 
-class ImageReviewer(TkinterDnD.Tk):
+class ImageReviewer(_ReviewerBase):
     def __init__(self):
         super().__init__()
         self.title("Image Reviewer v2.1 (Fixed)")
         self.geometry("1200x1000")
 
         self.config_data = load_config()
-        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        configure_metrics(self.config_data)
+        # Job counts for the performance HUD (updated from worker and I/O threads)
+        self._job_counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        self._job_counts_lock = threading.Lock()
+        self._jobs_in_flight = set()  # Sources of jobs not finished yet
+        self.worker_count = os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.worker_count)
+        self.journal = JobJournal()
+        self.io_writer = None
+        if self.config_data["io_engine"] == "asyncio":
+            self.io_writer = AsyncWriteBehindWriter(self.config_data["io_concurrency"])
+        elif self.config_data["write_behind"]:
+            self.io_writer = WriteBehindWriter(
+                io_workers=self.config_data["io_workers"],
+                max_pending_bytes=self.config_data["io_max_pending_mb"] * 1024 * 1024,
+                fadvise=self.config_data["io_fadvise"],
+            )
+        self._replay_sessions = []
+        # With a spool directory, keep/modify jobs run on worker processes (--spool-worker)
+        self.spool = None
+        self._spool_client = None
+        self._spooled = {}  # Job id -> (job, session) while a worker has it
+        if self.config_data["spool_dir"]:
+            try:
+                self.spool = JobSpool(self.config_data["spool_dir"])
+            except OSError as e:
+                print(f"!!! Spool directory unavailable, processing locally: {e}")
+            else:
+                self._spool_client = SpoolClient(self.spool)
+                self._spool_client.start()
+        # Decoded frames shared between the preview and the processing jobs
+        self.frame_cache = FrameCache(self.config_data["frame_cache_mb"] * 1024 * 1024)
+        # Decodes the full frame behind a reduced JPEG preview while the image is on screen
+        self._frame_decoder = ThreadPoolExecutor(max_workers=1)
+        self._wanted_frame = None
 
         # --- BUG FIX: Graceful shutdown ---
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -221,6 +3770,25 @@ class ImageReviewer(TkinterDnD.Tk):
         )
         self.btn_choose_central.pack(side=tk.LEFT, padx=5)
 
+        tk.Label(self.top_frame, text="Output layout:").pack(side=tk.LEFT, padx=(15, 0))
+        self.layout_var = tk.StringVar(value=OUTPUT_LAYOUTS.get(self.config_data["output_layout"], "Flat"))
+        layout_box = ttk.Combobox(self.top_frame, textvariable=self.layout_var, values=list(OUTPUT_LAYOUTS.values()),
+                                  state="readonly", width=18)
+        layout_box.pack(side=tk.LEFT, padx=5)
+        layout_box.bind("<<ComboboxSelected>>", self.on_layout_change)
+
+        tk.Label(self.top_frame, text="Write as:").pack(side=tk.LEFT, padx=(15, 0))
+        self.sink_var = tk.StringVar(value=OUTPUT_SINKS.get(self.config_data["output_sink"], "Files"))
+        sink_box = ttk.Combobox(self.top_frame, textvariable=self.sink_var, values=list(OUTPUT_SINKS.values()),
+                                state="readonly", width=15)
+        sink_box.pack(side=tk.LEFT, padx=5)
+        sink_box.bind("<<ComboboxSelected>>", self.on_sink_change)
+
+        self.depth_var = tk.IntVar(value=self.config_data["scan_subfolder_depth"])
+        self.depth_spinbox = tk.Spinbox(self.top_frame, from_=0, to=10, width=3, textvariable=self.depth_var)
+        self.depth_spinbox.pack(side=tk.RIGHT, padx=5)
+        tk.Label(self.top_frame, text="Subfolder depth:").pack(side=tk.RIGHT)
+
         # --- NEW: Authenticity Controls UI ---
         effects_frame = ttk.LabelFrame(self, text="Authenticity Effects", padding=(10, 5))
         effects_frame.pack(pady=5, padx=10, fill=tk.X)
@@ -228,6 +3796,9 @@ class ImageReviewer(TkinterDnD.Tk):
         self.realism_var = tk.BooleanVar(value=self.config_data.get("apply_realism_effects", True))
         self.realism_check = tk.Checkbutton(effects_frame, text="Apply Realism (Noise, Blur, Aberration)", variable=self.realism_var)
         self.realism_check.pack(side=tk.LEFT, padx=5)
+
+        self.downscale_var = tk.BooleanVar(value=self.config_data["downscale_to_device"])
+        tk.Checkbutton(effects_frame, text="Phone Resolution", variable=self.downscale_var).pack(side=tk.LEFT, padx=5)
         
         self.quality_label = tk.Label(effects_frame, text=f"JPEG Quality: {self.config_data.get('jpeg_quality', 85)}")
         self.quality_label.pack(side=tk.LEFT, padx=(20, 5))
@@ -238,9 +3809,51 @@ class ImageReviewer(TkinterDnD.Tk):
         )
         self.quality_slider.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
 
+        tk.Label(effects_frame, text="Encoder:").pack(side=tk.LEFT, padx=(20, 0))
+        self.encoder_var = tk.StringVar(value=self.config_data["encoder_profile"])
+        ttk.Combobox(effects_frame, textvariable=self.encoder_var, values=list(ENCODER_PROFILES),
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=5)
+        self.btn_calibrate = tk.Button(effects_frame, text="Calibrate", command=self.calibrate_encoders)
+        self.btn_calibrate.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(effects_frame, text="Max KB (0 = off):").pack(side=tk.LEFT, padx=(20, 0))
+        self.target_size_var = tk.IntVar(value=self.config_data["target_size_kb"])
+        tk.Spinbox(effects_frame, from_=0, to=100000, increment=50, width=6,
+                   textvariable=self.target_size_var).pack(side=tk.LEFT, padx=5)
+
+        # --- Queue ordering / filtering based on the folder index ---
+        queue_frame = ttk.LabelFrame(self, text="Review Queue", padding=(10, 5))
+        queue_frame.pack(pady=5, padx=10, fill=tk.X)
+
+        tk.Label(queue_frame, text="Order:").pack(side=tk.LEFT)
+        self.order_var = tk.StringVar(value=self.config_data["queue_order"])
+        order_box = ttk.Combobox(queue_frame, textvariable=self.order_var, values=list(QUEUE_ORDERS), state="readonly", width=28)
+        order_box.pack(side=tk.LEFT, padx=5)
+        order_box.bind("<<ComboboxSelected>>", lambda e: self.apply_queue_order())
+
+        tk.Label(queue_frame, text="Format:").pack(side=tk.LEFT, padx=(20, 0))
+        self.format_filter_var = tk.StringVar(value=self.config_data["queue_format_filter"])
+        format_box = ttk.Combobox(queue_frame, textvariable=self.format_filter_var, values=QUEUE_FORMAT_FILTERS, state="readonly", width=12)
+        format_box.pack(side=tk.LEFT, padx=5)
+        format_box.bind("<<ComboboxSelected>>", self.on_queue_filter_change)
+
+        tk.Label(queue_frame, text="Min MP:").pack(side=tk.LEFT, padx=(20, 0))
+        self.min_mp_var = tk.DoubleVar(value=self.config_data["queue_min_megapixels"])
+        min_mp_spinbox = tk.Spinbox(queue_frame, from_=0, to=200, increment=1, width=5, textvariable=self.min_mp_var,
+                                    command=self.on_queue_filter_change)
+        min_mp_spinbox.pack(side=tk.LEFT, padx=5)
+        min_mp_spinbox.bind("<Return>", self.on_queue_filter_change)
+
+        self.index_status_label = tk.Label(queue_frame, text="", fg="grey40")
+        self.index_status_label.pack(side=tk.RIGHT)
+        self.cluster_label = tk.Label(queue_frame, text="", fg="dark orange")
+        self.cluster_label.pack(side=tk.RIGHT, padx=10)
+        self.processed_label = tk.Label(queue_frame, text="", fg="red3")
+        self.processed_label.pack(side=tk.RIGHT, padx=10)
+
         # Info and status labels
         self.info_label = tk.Label(
-            self, text="Key Commands: • Keep -> [Right Arrow] or (k)  • Discard -> [Left Arrow] or (d)  • Modify -> [Up Arrow] or (u)", justify=tk.CENTER
+            self, text="Key Commands: • Keep -> [Right Arrow] or (k)  • Discard -> [Left Arrow] or (d)  • Modify -> [Up Arrow] or (u)  • Whole near-duplicate group -> [Shift] + key  • Performance HUD -> [F2]  • Profiler -> [F3]", justify=tk.CENTER
         )
         self.info_label.pack(pady=5)
         
@@ -248,25 +3861,61 @@ class ImageReviewer(TkinterDnD.Tk):
         self.current_folder_label.pack()
         self.central_folder_label = tk.Label(self, text="", fg="blue")
         self.central_folder_label.pack()
+        self.io_status_label = tk.Label(self, text="", fg="grey40")
+        self.io_status_label.pack()
+        self.hud_label = tk.Label(self, text="", anchor=tk.W, font=("Courier", 9), bg="grey15", fg="grey85")
+        self._hud_after_id = None
+        self._hud_history = deque(maxlen=HUD_WINDOW + 1)
 
         # Main image display area
         self.image_label = tk.Label(self, text="\n\nDrag and drop a folder here or use the 'Choose Folder' button.\n\n", bg="grey90")
         self.image_label.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
 
-        self.drop_target_register(DND_FILES)
-        self.dnd_bind("<<Drop>>", self.on_drop)
-
         self.bind("<Right>", self.keep_image)
         self.bind("k", self.keep_image)
         self.bind("<Left>", self.discard_image)
         self.bind("d", self.discard_image)
         self.bind("<Up>", self.modify_image)
         self.bind("u", self.modify_image)
+        self.bind("<Shift-Right>", lambda e: self.decide_cluster("keep"))
+        self.bind("<Shift-K>", lambda e: self.decide_cluster("keep"))
+        self.bind("<Shift-Left>", lambda e: self.decide_cluster("discard"))
+        self.bind("<Shift-D>", lambda e: self.decide_cluster("discard"))
+        self.bind("<Shift-Up>", lambda e: self.decide_cluster("modify"))
+        self.bind("<Shift-U>", lambda e: self.decide_cluster("modify"))
+        # With Caps Lock on the letters arrive upper case, with or without Shift
+        self.bind("<Lock-K>", self.keep_image)
+        self.bind("<Lock-D>", self.discard_image)
+        self.bind("<Lock-U>", self.modify_image)
+        self.bind("<Shift-Lock-K>", lambda e: self.decide_cluster("keep"))
+        self.bind("<Shift-Lock-D>", lambda e: self.decide_cluster("discard"))
+        self.bind("<Shift-Lock-U>", lambda e: self.decide_cluster("modify"))
+        self.bind("<F2>", self.toggle_hud)
+        self.bind("<F3>", self.toggle_profiler)
 
         self.image_paths = []
         self.current_index = 0
         self.current_folder = None
         self.current_img = None
+        self._preview_reduced = False  # current_img is a reduced decode, not a reusable frame
+        self._scanner = None
+        self._scanned_paths = []
+        self._folder_index = None
+        self._indexer = None
+        self._index_rows = {}
+        self._hasher = None
+        self._hashes = {}
+        self._hash_tree = BKTree()
+        self._checker = None
+        self._processed = {}
+        self._session = None
+        self._previous_sessions = []
+        self._leases = None  # LeaseKeeper in shared review mode
+        self._held_chunks = None  # None until the keeper has opened the lease table
+        self._lease_busy = False  # A next_chunk request is outstanding
+        self._lease_progress = None
+        self._passed_chunks = set()  # Chunks handed back because the queue filters hide their images
+        self._decided_paths = set()
         
         self._resize_after_id = None
         self.bind("<Configure>", self.on_window_resize)
@@ -274,17 +3923,123 @@ class ImageReviewer(TkinterDnD.Tk):
         # Initial UI state
         self.toggle_central_folder()
 
+        # Finish whatever was still queued when the app last closed or crashed
+        self.replay_unfinished_jobs()
+        self.update_io_status()
+        # Once the window is up: drag and drop, then the processing modules
+        self.after(STARTUP_DEFERRED_MS, self._finish_startup)
+        if self.config_data["performance_hud"]:
+            self.toggle_hud()
+        requested = profile_from_env()
+        if self.spool:
+            self.after(int(SPOOL_POLL_INTERVAL * 1000), self._poll_spool)
+        if requested:
+            mode, seconds = requested
+            self.toggle_profiler(mode=mode)
+            if seconds:
+                self.after(int(seconds * 1000), lambda: profiler.active and self.toggle_profiler())
+
+    def _finish_startup(self):
+        self._enable_drag_and_drop()
+        threading.Thread(target=warm_up_processing, name="warm-up", daemon=True).start()
+
+    def _enable_drag_and_drop(self):
+        """
+        Loads tkdnd into the running Tk; folders can be dropped onto the image
+        area from then on. tkinterdnd2 adds its methods to tkinter.BaseWidget,
+        which tk.Tk is not, so the drop target is the image label.
+        """
+        try:
+            from tkinterdnd2 import DND_FILES, TkinterDnD
+            TkinterDnD._require(self)
+            self.image_label.drop_target_register(DND_FILES)
+            self.image_label.dnd_bind("<<Drop>>", self.on_drop)
+        except (ImportError, RuntimeError, tk.TclError) as e:
+            print(f"Drag and drop unavailable, use 'Choose Folder': {e}")
+
     def on_closing(self):
         """Handle window closing event."""
         print("Closing application... waiting for file operations to complete.")
+        if profiler.active:
+            self.toggle_profiler()
         # Save final config
         self.config_data["jpeg_quality"] = self.quality_var.get()
         self.config_data["apply_realism_effects"] = self.realism_var.get()
+        self.config_data["encoder_profile"] = self.encoder_var.get()
+        self.config_data["target_size_kb"] = self.get_target_size_kb()
+        self.config_data["downscale_to_device"] = self.downscale_var.get()
+        self.config_data["scan_subfolder_depth"] = self.get_scan_depth()
+        self.config_data["queue_order"] = self.order_var.get()
+        self.config_data["queue_format_filter"] = self.format_filter_var.get()
+        self.config_data["queue_min_megapixels"] = self.get_min_megapixels()
+        self.config_data["performance_hud"] = self._hud_after_id is not None
         save_config(self.config_data)
 
+        if self._scanner:
+            self._scanner.stop()
+        if self._indexer:
+            self._indexer.stop()
+        if self._hasher:
+            self._hasher.stop()
+        if self._checker:
+            self._checker.stop()
+        if self._leases:
+            self._release_leases(wait=True)
+        if self._spool_client:
+            self._spool_client.stop()  # Writes the jobs still queued for the spool
+            self._drain_spool_results()  # Jobs that could not be spooled run here before the executor stops
+
+        self._wanted_frame = None
+        self._frame_decoder.shutdown(wait=False)
         self.executor.shutdown(wait=True)  # Wait for all threads to finish
+        if self.io_writer:
+            self.io_writer.close()  # Flush the write-behind queue
+            if self.io_writer.stats():
+                print(f"Disk throughput: {self.io_writer.format_stats()}")
+        close_container_sinks()
+        # Jobs cancelled, or lost to a crashed task, stay in the journal. Spooled jobs are not journaled.
+        with self._job_counts_lock:
+            unfinished = self._job_counts["pending"] + self._job_counts["running"] - len(self._spooled)
+        if unfinished:
+            print(f"{unfinished} job(s) did not finish and will be replayed on the next start")
+        self.journal.close(all_finished=unfinished == 0)
+        manifest_writer.close()
+        close_processed_index()
+        metrics.close()
+        # After the executor, so job results are recorded
+        for session in [self._session] + self._previous_sessions + self._replay_sessions:
+            if session:
+                session.close()
         self.destroy() # Close the window
 
+    def on_layout_change(self, event=None):
+        label = self.layout_var.get()
+        self.config_data["output_layout"] = next(k for k, v in OUTPUT_LAYOUTS.items() if v == label)
+
+    def on_sink_change(self, event=None):
+        label = self.sink_var.get()
+        self.config_data["output_sink"] = next(k for k, v in OUTPUT_SINKS.items() if v == label)
+
+    def calibrate_encoders(self):
+        """Measures every encoder profile on a sample of the current folder (in the background)."""
+        paths = self._scanned_paths or self.image_paths
+        if not paths:
+            messagebox.showinfo("Calibrate Encoders", "Open a folder first.")
+            return
+        self.btn_calibrate.config(state=tk.DISABLED, text="Calibrating...")
+        quality = self.quality_var.get()
+
+        def run():
+            results = calibrate_encoder_profiles(paths, quality)
+            self.after(0, show, results)
+
+        def show(results):
+            self.btn_calibrate.config(state=tk.NORMAL, text="Calibrate")
+            messagebox.showinfo("Calibrate Encoders",
+                                f"Encoder profiles at quality {quality}:\n\n{format_calibration(results)}")
+
+        threading.Thread(target=run, daemon=True).start()
+
     def on_quality_change(self, value):
         """Update label when slider moves."""
         quality = int(float(value))
@@ -301,44 +4056,437 @@ class ImageReviewer(TkinterDnD.Tk):
         if os.path.isdir(folder):
             self.load_images(folder)
 
+    def get_scan_depth(self):
+        try:
+            return max(0, int(self.depth_var.get()))
+        except (tk.TclError, ValueError):
+            return 0
+
+    def get_target_size_kb(self):
+        try:
+            return max(0, int(self.target_size_var.get()))
+        except (tk.TclError, ValueError):
+            return 0
+
+    def get_min_megapixels(self):
+        try:
+            return max(0.0, float(self.min_mp_var.get()))
+        except (tk.TclError, ValueError):
+            return 0.0
+
     def load_images(self, folder):
         self.current_folder = folder
-        valid_exts = [".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".webp"]
-        
+        if self._scanner:
+            self._scanner.stop()
+        if self._indexer:
+            self._indexer.stop()
+        if self._hasher:
+            self._hasher.stop()
+        if self._checker:
+            self._checker.stop()
+        if self._leases:
+            self._release_leases()
+
+        self.image_paths = []
+        self._scanned_paths = []
+        self.current_index = 0
+        self.current_img = None
+
+        # Metadata from earlier visits is available right away for ordering
+        self._indexer = None
+        self._index_rows = {}
+        self._hasher = None
+        self._hashes = {}
+        self._hash_tree = BKTree()
+        # Sources processed before, from any folder, are found while the folder is scanned
+        self._checker = None
+        self._processed = {}
+        processed_index = get_processed_index()
+        if processed_index is not None:
+            self._checker = ProcessedSourceChecker(processed_index)
+            self._checker.start()
         try:
-            all_files = os.listdir(folder)
-            self.image_paths = sorted([
-                os.path.join(folder, f)
-                for f in all_files
-                if os.path.splitext(f)[1].lower() in valid_exts
-            ])
-            self.current_index = 0
-            
-            if self.toggle_var.get() is False:
-                 self.current_folder_label.config(text=f"Current Folder: {folder}")
-
-            if self.image_paths:
-                self.show_image()
-            else:
-                self.image_label.config(text="No images found in the selected folder.", image=None, bg="grey90")
-                self.image_label.image = None
-        except Exception as e:
-            self.image_label.config(text=f"Error loading folder: {e}", image=None, bg="grey90")
+            self._folder_index = FolderIndex(folder)
+            self._index_rows = self._folder_index.load_rows()
+            self._indexer = FolderIndexer(self._folder_index)
+            self._indexer.start()
+            self._load_hashes(self._folder_index.load_hashes())
+            if self.config_data["near_duplicate_hashing"]:
+                self._hasher = HashIndexer(self._folder_index)
+                self._hasher.start()
+        except sqlite3.Error as e:
+            self._folder_index = None
+            print(f"Folder index unavailable for {folder}: {e}")
+        self.update_index_status()
+
+        # Decisions made earlier, or by other reviewers of a shared folder, are not shown again
+        if self._session:
+            self._previous_sessions.append(self._session)  # Jobs still running report to it
+        self._session = None
+        self._decided_paths = set()
+        try:
+            self._session = ReviewSession(folder)
+            self._decided_paths = self._session.decided_paths()
+            # Failed jobs, and jobs lost with no journal entry, come back for a new decision
+            unfinished = self._session.unfinished_jobs()
+            with self._job_counts_lock:
+                unfinished = [job for job in unfinished if job[0] not in self._jobs_in_flight]
+            retry = {path for path, _, _, _ in unfinished}
+            if self.spool:
+                retry -= self._reconcile_spool(unfinished)
+            if retry:
+                print(f"{len(retry)} image(s) whose processing failed or was lost are queued again")
+                self._decided_paths -= retry
+        except sqlite3.Error as e:
+            print(f"Review progress unavailable for {folder}: {e}")
+        self._open_leases(folder)
+
+        if self.toggle_var.get() is False:
+             self.current_folder_label.config(text=f"Current Folder: {folder}")
+        self.image_label.config(text="Scanning folder...", image="", bg="grey90")
+        self.image_label.image = None
+
+        # Enumerate in the background; images are shown as soon as they are found
+        self._scanner = FolderScanner(folder, self.get_scan_depth())
+        self._scanner.start()
+        self._poll_scanner(self._scanner)
+
+    def _poll_scanner(self, scanner):
+        if scanner is not self._scanner:
+            return  # A different folder was loaded in the meantime
+        paths = scanner.drain()
+        if paths:
+            self._merge_scanned_paths(paths)
+            if self._indexer:
+                self._indexer.add(paths)
+            if self._hasher:
+                self._hasher.add(paths)
+            if self._checker:
+                self._checker.add(paths)
+
+        if not scanner.done or not scanner.batches.empty():
+            self.after(50, self._poll_scanner, scanner)
+            return
+
+        if self._indexer:
+            self._indexer.finish()
+            self._poll_indexer(self._indexer)
+        if self._hasher:
+            self._hasher.finish()
+            self._poll_hasher(self._hasher)
+        if self._checker:
+            self._checker.finish()
+            self._poll_checker(self._checker)
+
+        if scanner.error is not None:
+            self.image_label.config(text=f"Error loading folder: {scanner.error}", image="", bg="grey90")
             self.image_label.image = None
+        elif not self.image_paths and not self._next_lease():
+            self.image_label.config(text="No images found in the selected folder.", image="", bg="grey90")
+            self.image_label.image = None
+        elif self.current_index >= len(self.image_paths):
+            self.show_image()
+
+    def _merge_scanned_paths(self, paths):
+        """
+        Adds newly found paths to the queue. Images that were already shown and
+        the current image keep their position; only the not-yet-reviewed tail
+        is kept sorted, so the order the reviewer sees stays stable.
+        """
+        self._scanned_paths.extend(paths)
+        waiting = self.current_index >= len(self.image_paths)
+        start = min(self.current_index + 1, len(self.image_paths))
+        tail = self.image_paths[start:]
+        tail.extend(p for p in paths if self._queue_accepts(p))
+        self._sort_queue(tail)
+        self.image_paths[start:] = tail
+        if waiting:
+            self.show_image()
+
+    def _queue_accepts(self, path):
+        """Applies the queue filters. Files not indexed yet are always accepted."""
+        if path in self._decided_paths:
+            return False
+        if path in self._processed and self.config_data["skip_processed_sources"]:
+            return False
+        if self._leases and (self._held_chunks is None or self._leases.chunk_of(path) not in self._held_chunks):
+            return False
+        row = self._index_rows.get(path)
+        if row is None:
+            return True
+        fmt = self.format_filter_var.get()
+        if fmt != "All formats" and row["format"] != fmt:
+            return False
+        min_mp = self.get_min_megapixels()
+        return not min_mp or row["width"] * row["height"] >= min_mp * 1_000_000
+
+    def _sort_queue(self, paths):
+        order = QUEUE_ORDERS.get(self.order_var.get())
+        paths.sort()
+        if order is None:
+            return
+        key, reverse = order
+        rows = self._index_rows
+        # Stable sort on top of the name order; files not indexed yet go last
+        indexed = [p for p in paths if p in rows]
+        unindexed = [p for p in paths if p not in rows]
+        indexed.sort(key=lambda p: key(rows[p]), reverse=reverse)
+        paths[:] = indexed + unindexed
+
+    def apply_queue_order(self):
+        """Rebuilds the not-yet-reviewed part of the queue with the current order and filters."""
+        if not self.current_folder:
+            return
+        start = min(self.current_index + 1, len(self.image_paths))
+        seen = set(self.image_paths[:start])
+        tail = [p for p in self._scanned_paths if p not in seen and self._queue_accepts(p)]
+        self._sort_queue(tail)
+        waiting = self.current_index >= len(self.image_paths)
+        self.image_paths[start:] = tail
+        if waiting and tail:
+            self.show_image()
+
+    def _poll_indexer(self, indexer):
+        if indexer is not self._indexer:
+            return
+        if not indexer.done:
+            self.after(200, self._poll_indexer, indexer)
+            return
+        if indexer.updated:
+            # Newly indexed files can now take part in ordering/filtering
+            self._index_rows = self._folder_index.load_rows()
+            self.apply_queue_order()
+        self.update_index_status()
+
+    def _open_leases(self, folder):
+        """In shared review mode, starts the lease keeper, which leases the first chunk while the folder is scanned."""
+        self._passed_chunks = set()
+        self._held_chunks = None
+        self._lease_progress = None
+        if not self.config_data["shared_review"]:
+            return
+        owner = f"{platform.node()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._leases = LeaseKeeper(folder, owner, self.config_data["lease_chunks"], self.config_data["lease_seconds"])
+        self._lease_busy = True  # Until the first chunk is leased
+        self._leases.start()
+        self._poll_leases(self._leases)
+
+    def _poll_leases(self, keeper):
+        if keeper is not self._leases:
+            return
+        dry = False
+        while not keeper.results.empty():
+            kind, value = keeper.results.get()
+            if kind == "opened":
+                self._lease_busy = False
+                if isinstance(value, Exception):
+                    print(f"Shared review unavailable for {self.current_folder}, reviewing the whole folder: {value}")
+                    self._leases = None
+                    self.apply_queue_order()
+                    self.update_index_status()
+                    return
+                self._held_chunks = value[1]
+                self.apply_queue_order()
+                dry = True
+            elif kind == "leased":
+                self._lease_busy = False
+                chunk, self._held_chunks, decided = value
+                self._decided_paths |= decided
+                if chunk is None:
+                    if self.current_index >= len(self.image_paths):
+                        self.display_end_of_review()
+                else:
+                    self.apply_queue_order()
+                    dry = True
+            elif kind == "renewed":
+                lost, self._held_chunks = value
+                if lost:
+                    print(f"Lease on chunk(s) {sorted(lost)} expired and was taken over by another reviewer")
+                    self.apply_queue_order()
+                # With nothing held, retries chunks whose reviewers stopped renewing them
+                dry = not self._held_chunks
+            elif kind == "progress":
+                self._lease_progress = value
+                self.update_index_status()
+        scanned = not self._scanner or self._scanner.done
+        if dry and scanned and not self._lease_busy and self.current_index >= len(self.image_paths):
+            self.show_image()  # Asks for the next chunk if this one has nothing to show
+        self.after(200, self._poll_leases, keeper)
+
+    def _next_lease(self):
+        """
+        Called when the queue runs dry in shared review mode: settles the held
+        chunks and asks the lease keeper for the next chunk. Returns True while
+        more images may come; they are queued once the chunk is leased.
+        """
+        if not self._leases or (self._scanner and not self._scanner.done):
+            return False
+        if not self._lease_busy:
+            finished, hidden = self._settle_chunks()
+            self._lease_busy = True
+            self._leases.next_chunk(finished, hidden, self._passed_chunks, self._session)
+        self.image_label.config(text="Looking for more images to review...", image="", bg="grey90")
+        self.image_label.image = None
+        return True
+
+    def _settle_chunks(self):
+        """
+        With the queue dry, returns (finished, hidden) held chunks. A chunk is
+        finished if every file in it has a decision. Chunks whose remaining
+        files are only hidden by this reviewer's format or size filters are
+        handed back for other reviewers instead, and not leased again until
+        the filters change.
+        """
+        held = self._held_chunks or set()
+        skip_processed = self.config_data["skip_processed_sources"]
+        open_chunks = {self._leases.chunk_of(p) for p in self._scanned_paths
+                       if p not in self._decided_paths and not (skip_processed and p in self._processed)}
+        hidden = held & open_chunks
+        if hidden:
+            self._passed_chunks |= hidden
+            print(f"Chunk(s) {sorted(hidden)} still have images hidden by the queue filters; "
+                  f"left for other reviewers")
+        return held - open_chunks, hidden
+
+    def on_queue_filter_change(self, event=None):
+        self._passed_chunks.clear()  # Chunks passed over may have images for the new filters
+        self.apply_queue_order()
+
+    def _release_leases(self, wait=False):
+        """Stops the lease keeper, which hands the unfinished chunks back (in the background unless `wait`)."""
+        keeper, self._leases = self._leases, None
+        keeper.stop()
+        if wait:
+            keeper.join()
+
+    def _poll_checker(self, checker):
+        if checker is not self._checker:
+            return
+        done = checker.done  # Read first: everything found before it was set is queued
+        found = {}
+        while not checker.found.empty():
+            found.update(checker.found.get())
+        if found:
+            self._processed.update(found)
+            if self.config_data["skip_processed_sources"]:
+                self._remove_from_queue(found)
+            self.update_source_status()
+            self.update_index_status()
+        if not done:
+            self.after(500, self._poll_checker, checker)
+
+    def _remove_from_queue(self, paths):
+        """Drops `paths` (a set or dict) from the not-yet-reviewed part of the queue, keeping its order."""
+        start = self.current_index + 1
+        self.image_paths[start:] = [p for p in self.image_paths[start:] if p not in paths]
+
+    def update_source_status(self):
+        match = None
+        if self.image_paths and self.current_index < len(self.image_paths):
+            match = self._processed.get(self.image_paths[self.current_index])
+        self.processed_label.config(text=f"Already processed: {match['output']}" if match else "")
+
+    def _poll_hasher(self, hasher):
+        if hasher is not self._hasher:
+            return
+        # Hashes are committed in batches; pick up the new ones while hashing goes on
+        done = hasher.done  # Read first: everything written before it was set is queued
+        hashes = {}
+        while not hasher.found.empty():
+            hashes.update(hasher.found.get())
+        if hashes or done:
+            self._load_hashes(hashes)
+            self.update_cluster_status()
+            self.update_index_status()
+        if not done:
+            self.after(1000, self._poll_hasher, hasher)
+
+    def _load_hashes(self, hashes):
+        for path, value in hashes.items():
+            previous = self._hashes.get(path)
+            if previous == value:
+                continue
+            if previous is not None:
+                self._hash_tree.remove(previous, path)  # The file changed since it was hashed
+            self._hash_tree.add(value, path)
+            self._hashes[path] = value
+
+    def near_duplicates(self, path):
+        """Returns the images still waiting in the queue that look nearly identical to `path`."""
+        value = self._hashes.get(path)
+        if value is None:
+            return []
+        candidates = {p for _, p in self._hash_tree.search(value, self.config_data["near_duplicate_distance"])
+                      if p != path and p not in self._decided_paths}
+        if not candidates:
+            return []
+        return [p for p in self.image_paths[self.current_index + 1:] if p in candidates]
+
+    def update_cluster_status(self):
+        if not self.image_paths or self.current_index >= len(self.image_paths):
+            self.cluster_label.config(text="")
+            return
+        count = len(self.near_duplicates(self.image_paths[self.current_index]))
+        self.cluster_label.config(text=f"{count} near-duplicate(s) queued, [Shift] + key decides all" if count else "")
+
+    def update_index_status(self):
+        if self._folder_index is None:
+            self.index_status_label.config(text="Index: unavailable")
+        elif self._indexer and not self._indexer.done:
+            self.index_status_label.config(text=f"Index: {len(self._index_rows)} files, updating...")
+        else:
+            self.index_status_label.config(text=f"Index: {len(self._index_rows)} files")
+        if self._hasher and not self._hasher.done:
+            self.index_status_label.config(
+                text=f"{self.index_status_label.cget('text')}, {len(self._hashes)} hashed")
+        if self._processed:
+            self.index_status_label.config(
+                text=f"{self.index_status_label.cget('text')}, {len(self._processed)} processed before")
+        if self._leases and self._lease_progress:
+            done, others, chunks = self._lease_progress
+            self.index_status_label.config(
+                text=f"{self.index_status_label.cget('text')} | Shared: {done}/{chunks} chunks done, "
+                     f"{others} with other reviewers")
 
     def show_image(self):
         if not (0 <= self.current_index < len(self.image_paths)):
-             self.display_end_of_review()
+             if not self._next_lease():
+                 self.display_end_of_review()
              return
 
         path = self.image_paths[self.current_index]
         try:
-            self.current_img = Image.open(path)
+            img, self._preview_reduced = open_preview(path, self._preview_box())
+            self.current_img = img
+            if not self._preview_reduced:
+                # Decoded in full once; the frame is reused if the image is kept
+                self.frame_cache.put(path, img)
+            elif not self.spool:
+                self._wanted_frame = path
+                self._frame_decoder.submit(self._decode_full_frame, path)
             self.render_scaled_image()
+            self.update_cluster_status()
+            self.update_source_status()
         except Exception as e:
             print(f"Error opening {path}: {e}")
             self.go_next_image() # Skip corrupted/unreadable image
 
+    def _decode_full_frame(self, path):
+        """Puts the full frame of a reduced preview into the frame cache (on the decoder thread)."""
+        if self._wanted_frame != path:
+            return  # Already moved on; a decision on it decodes the file itself
+        try:
+            img, _ = open_preview(path, None)
+        except Exception:
+            return  # Same as above
+        self.frame_cache.put(path, img)
+
+    def _preview_box(self):
+        """The label size a preview is decoded for, or None before the window is laid out."""
+        max_w = self.image_label.winfo_width()
+        max_h = self.image_label.winfo_height()
+        return (max_w, max_h) if max_w >= 50 and max_h >= 50 else None
+
     def render_scaled_image(self):
         if not self.current_img:
             return
@@ -349,56 +4497,344 @@ class ImageReviewer(TkinterDnD.Tk):
         
         if max_w < 50 or max_h < 50: return # Avoid rendering in tiny windows
 
+        # Orientation is applied to the small preview, not the full frame; the
+        # frame stays as decoded so a keep/modify job can reuse it
+        label_box = (max_w, max_h)
+        orientation = get_orientation(self.current_img)
+        if orientation_swaps_axes(orientation):
+            max_w, max_h = max_h, max_w
+        if self._preview_reduced and max_w > self.current_img.width and max_h > self.current_img.height:
+            # The window grew past the reduced decode; decode again for the new size
+            path = self.image_paths[self.current_index]
+            try:
+                self.current_img, self._preview_reduced = open_preview(path, label_box)
+            except Exception as e:
+                print(f"Error opening {path}: {e}")
         temp_img = self.current_img.copy()
         temp_img.thumbnail((max_w, max_h), LANCZOS)
+        temp_img = apply_orientation(temp_img, orientation)
         
         tk_img = ImageTk.PhotoImage(temp_img)
         self.image_label.config(image=tk_img, text="", bg="grey20") # Dark bg for images
         self.image_label.image = tk_img # Keep reference
 
-    def _process_image_task(self, img_path, subfolder):
-        """Generic background task for processing and saving an image."""
+    def _process_image_task(self, job, frame=None, session=None):
+        """Background task for processing and saving an image."""
+        img_path = job["src"]
+        self._count_job("pending", "running")
+        record = metrics.begin_job(job)
+        try:
+            with profiler.task():
+                result = process_job(job, frame, self.io_writer)
+        except Exception as e:
+            self._job_finished(job, session, error=e, record=record)
+        else:
+            if isinstance(result, Future):
+                # Written later by the write-behind stage
+                result.add_done_callback(lambda f: self._job_finished(
+                    job, session, output_dst=None if f.exception() else f.result(), error=f.exception(),
+                    record=record))
+            else:
+                self._job_finished(job, session, output_dst=result, record=record)
+        finally:
+            metrics.attach(None)
+            if frame is not None:
+                self.frame_cache.release(img_path)
+
+    def _job_finished(self, job, session, output_dst=None, error=None, record=None):
+        """Records the outcome of a job (called from worker or I/O threads)."""
+        img_path = job["src"]
+        self._count_job("running", "done" if error is None else "failed", img_path)
+        if error is None:
+            # With a metrics file, the job's line there replaces this
+            if not metrics.logs_jobs:
+                print(f"Successfully processed and saved to {output_dst}")
+            metrics.end_job(record, "done", output=output_dst)
+            self.journal.finish(job["id"], "done")
+            if session:
+                session.record_job_status(img_path, "done", output_dst)
+        else:
+            print(f"!!! FAILED to process {os.path.basename(img_path)}: {error}")
+            metrics.end_job(record, "failed", error=error)
+            self.journal.finish(job["id"], "failed")
+            if session:
+                session.record_job_status(img_path, "failed")
+
+    def _count_job(self, from_state, to_state, src=None):
+        with self._job_counts_lock:
+            if from_state:
+                self._job_counts[from_state] -= 1
+            self._job_counts[to_state] += 1
+            if to_state == "pending":
+                self._jobs_in_flight.add(src)
+            elif to_state in ("done", "failed"):
+                self._jobs_in_flight.discard(src)
+
+    def toggle_hud(self, event=None):
+        """Shows or hides the performance strip (F2)."""
+        if self._hud_after_id is not None:
+            self.after_cancel(self._hud_after_id)
+            self._hud_after_id = None
+            self.hud_label.pack_forget()
+            metrics.collect_in_memory(False)
+            return
+        metrics.collect_in_memory()  # Stage timings, also without a metrics file
+        self._hud_history.clear()
+        self.hud_label.pack(side=tk.BOTTOM, fill=tk.X, before=self.image_label)
+        self.update_hud()
+
+    def update_hud(self):
+        """
+        Refreshes the performance strip every HUD_INTERVAL_MS from counters the
+        workers keep anyway; nothing is pushed to the UI from the workers.
+        images/s and stage averages cover the last HUD_WINDOW refreshes.
+        """
+        with self._job_counts_lock:
+            counts = dict(self._job_counts)
+        now = time.perf_counter()
+        totals = metrics.stage_totals()
+        self._hud_history.append((now, counts["done"] + counts["failed"], totals))
+        then, finished_then, totals_then = self._hud_history[0]
+        rate = (counts["done"] + counts["failed"] - finished_then) / (now - then) if now > then else 0.0
+
+        stage_parts = []
+        for stage in METRIC_STAGES:
+            total_ms, count = totals[stage]
+            recent_count = count - totals_then[stage][1]
+            if recent_count:
+                stage_parts.append(f"{stage} {(total_ms - totals_then[stage][0]) / recent_count:.0f}")
+            elif count:
+                stage_parts.append(f"{stage} {total_ms / count:.0f}")
+        # Share of keep/modify jobs that got the frame decoded for the preview
+        lookups = self.frame_cache.hits + self.frame_cache.misses
+        reuse_rate = f"{self.frame_cache.hits / lookups:.0%}" if lookups else "-"
+        rss = current_rss_mb()
+
+        text = (f" Jobs: {counts['pending']} pending, {counts['running']} running, {counts['done']} done"
+                + (f", {counts['failed']} failed" if counts["failed"] else "")
+                + f"  |  {rate:.2f} img/s"
+                + (f"  |  ms: {', '.join(stage_parts)}" if stage_parts else "")
+                + f"  |  jobs reusing preview frame {reuse_rate}"
+                + (f"  |  RSS {rss:.0f} MB" if rss is not None else ""))
+        # Amber once the backlog is more than twice the workers: time to slow down
+        backlog = counts["pending"] > 2 * self.worker_count
+        self.hud_label.config(text=text, fg="orange" if backlog else "grey85")
+        self._hud_after_id = self.after(HUD_INTERVAL_MS, self.update_hud)
+
+    def toggle_profiler(self, event=None, mode=None):
+        """Starts or stops profiling (F3); results go to the profile_dir folder."""
+        if profiler.active:
+            folder = profiler.stop(self.config_data["profile_dir"])
+            self.title(self.title().replace(" [profiling]", ""))
+            print(f"Profile written to {folder}")
+            return
+        try:
+            profiler.start(mode or self.config_data["profile_mode"])
+        except ValueError as e:
+            print(f"Profiler not started: {e}")
+            return
+        self.title(self.title() + " [profiling]")
+        print(f"Profiling ({profiler.mode}); press F3 again to stop and write the results")
+
+    def update_io_status(self):
+        """Shows write-behind throughput per device, refreshed every 2 seconds."""
+        parts = []
+        if self.io_writer and self.io_writer.format_stats():
+            parts.append(f"Disk writes: {self.io_writer.format_stats()}")
+        if size_model.images:
+            parts.append(f"Target size: {size_model.encodes_per_image():.2f} encodes/image")
+        self.io_status_label.config(text="  |  ".join(parts))
+        self.after(2000, self.update_io_status)
+
+    def create_job(self, img_path, subfolder):
+        """Snapshots everything a job needs at the moment the key is pressed."""
         base_out = self.get_base_out()
-        output_folder = os.path.join(base_out, subfolder)
-        archive_folder = os.path.join(base_out, "archive")
-        os.makedirs(output_folder, exist_ok=True)
-        os.makedirs(archive_folder, exist_ok=True)
+        # Name and capture time are fixed now, so a replayed job rewrites the same file
+        photo_datetime, output_name, seq = get_name_allocator(os.path.join(base_out, subfolder)).allocate()
+        layout = self.config_data["output_layout"]
+        return {
+            "id": uuid.uuid4().hex,
+            "src": img_path,
+            "subfolder": subfolder,
+            "base_out": base_out,
+            "review_folder": self.current_folder,
+            "output_name": output_name,
+            "shard": output_shard(layout, output_name, photo_datetime, seq, self.config_data["output_shard_size"]),
+            "photo_datetime": photo_datetime.isoformat(),
+            "settings": {
+                "quality": self.quality_var.get(),
+                "apply_effects": self.realism_var.get(),
+                "encoder_profile": self.encoder_var.get(),
+                "target_size_kb": self.get_target_size_kb(),
+                "downscale_to_device": self.downscale_var.get(),
+                "frame_selection": self.config_data["frame_selection"],
+                "output_sink": self.config_data["output_sink"],
+                "container_max_mb": self.config_data["container_max_mb"],
+                "container_max_files": self.config_data["container_max_files"],
+            },
+        }
 
-        # 1. Archive the original image (lossless copy)
-        archive_dst = os.path.join(archive_folder, os.path.basename(img_path))
-        shutil.copy2(img_path, archive_dst)
+    def submit_job(self, img_path, subfolder, advance=True):
+        job = self.create_job(img_path, subfolder)
+        if self.spool:
+            self.record_decision(img_path, subfolder, job["id"])
+            if advance:
+                self.go_next_image()
+            self._spool_job(job)
+            return
+        # Pin the decoded frame before the next preview can evict it
+        frame = self.frame_cache.acquire(img_path)
+        self.journal.submit(job)
+        self.record_decision(img_path, subfolder, job["id"])
+        if advance:
+            self.go_next_image()
+        self._count_job(None, "pending", img_path)
+        self.executor.submit(self._process_image_task, job, frame, self._session)
 
-        # 2. Process and save the modified version
-        new_filename = f"IMG_{generate_todays_datetime().strftime('%Y%m%d_%H%M%S')}.jpg"
-        output_dst = os.path.join(output_folder, new_filename)
-        
-        # Get settings from UI at the moment of the action
-        quality = self.quality_var.get()
-        apply_effects = self.realism_var.get()
-        
+    def _spool_job(self, job):
+        """Hands a job to the spool; the spool file is its durable record instead of the journal."""
+        self._count_job(None, "pending", job["src"])
+        self._spooled[job["id"]] = (job, self._session)
+        self._spool_client.submit(job)
+
+    def _poll_spool(self):
+        """Picks up the outcome of spooled jobs from the workers."""
+        self._drain_spool_results()
+        self.after(int(SPOOL_POLL_INTERVAL * 1000), self._poll_spool)
+
+    def _drain_spool_results(self):
+        while not self._spool_client.results.empty():
+            kind, key, value = self._spool_client.results.get()
+            if kind == "unsent":
+                job, session = self._spooled.pop(key["id"])
+                print(f"!!! Could not spool {os.path.basename(job['src'])}, processing it here: {value}")
+                self.journal.submit(job)
+                self.executor.submit(self._process_image_task, job, None, session)
+                continue
+            entry = self._spooled.pop(key, None)
+            if entry is None:
+                continue
+            job, session = entry
+            self._count_job("pending", value["status"], job["src"])
+            self._spool_outcome(job, session, value)
+
+    def _spool_outcome(self, job, session, result):
+        """Records the outcome of a spooled job that a worker finished."""
+        if result["status"] == "done":
+            if not metrics.logs_jobs:
+                print(f"Processed on {result['worker']}: {result['output']}")
+            if session:
+                session.record_job_status(job["src"], "done", result["output"])
+            # The worker recorded the source in its own processed index; record it here as well.
+            # Hashing reads the whole file, so it runs on a worker thread.
+            self.executor.submit(self._record_processed, result)
+        else:
+            print(f"!!! FAILED on {result['worker']}: {os.path.basename(job['src'])}: {result['error']}")
+            if session:
+                session.record_job_status(job["src"], "failed")
+
+    @staticmethod
+    def _record_processed(result):
+        index = get_processed_index()
+        if index is None:
+            return
         try:
-            save_with_metadata_and_effects(img_path, output_dst, quality, apply_effects)
-            print(f"Successfully processed and saved to {output_dst}")
-        except Exception as e:
-            print(f"!!! FAILED to process {os.path.basename(img_path)}: {e}")
+            index.add(result["src"], result["output"], result["subfolder"])
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not record {result['src']} as processed: {e}")
+
+    def _reconcile_spool(self, unfinished):
+        """
+        Matches pending decisions of an earlier session against the spool by
+        job id. Outcomes that arrived while the reviewer was closed are
+        recorded, and jobs still pending or claimed are tracked again.
+        Returns the paths that need no new decision.
+        """
+        try:
+            queued = self.spool.queued_ids()
+            finished = self.spool.finished_ids()
+        except OSError as e:
+            print(f"!!! Spool directory unavailable, spooled jobs are checked on the next start: {e}")
+            return {path for path, _, status, job_id in unfinished if status == "pending" and job_id}
+        settled = set()
+        for path, decision, status, job_id in unfinished:
+            if status != "pending" or not job_id:
+                continue
+            job = {"id": job_id, "src": path, "subfolder": decision}
+            if job_id in queued:
+                self._count_job(None, "pending", path)
+                self._spooled[job_id] = (job, self._session)
+                self._spool_client.watch(job_id)
+                settled.add(path)
+                continue
+            if job_id not in finished:
+                continue  # Lost
+            try:
+                result = self.spool.read_result(job_id, finished[job_id])
+            except (OSError, ValueError):
+                settled.add(path)  # Unreadable for now; checked on the next start
+                continue
+            self._spool_outcome(job, self._session, result)
+            if result["status"] == "done":
+                settled.add(path)
+        return settled
 
+    def replay_unfinished_jobs(self):
+        """Re-queues jobs that were still pending when the app last exited."""
+        try:
+            jobs = self.journal.recover()
+        except OSError as e:
+            print(f"!!! Job journal unavailable, queued jobs will not survive a crash: {e}")
+            return
+        if not jobs:
+            return
+        print(f"Replaying {len(jobs)} unfinished job(s) from the last session...")
+        sessions = {}
+        for job in jobs:
+            folder = job.get("review_folder")
+            if folder and folder not in sessions:
+                try:
+                    sessions[folder] = ReviewSession(folder)
+                except sqlite3.Error:
+                    sessions[folder] = None
+            self._count_job(None, "pending", job["src"])
+            self.executor.submit(self._process_image_task, job, None, sessions.get(folder))
+        self._replay_sessions = [session for session in sessions.values() if session]
 
     def keep_image(self, event=None):
         if not self.image_paths or self.current_index >= len(self.image_paths): return
-        img_path = self.image_paths[self.current_index]
-        self.go_next_image()
-        self.executor.submit(self._process_image_task, img_path, "keep")
+        self.submit_job(self.image_paths[self.current_index], "keep")
 
     def discard_image(self, event=None):
         if not self.image_paths or self.current_index >= len(self.image_paths): return
         # Simply move to the next image without any processing
+        self.record_decision(self.image_paths[self.current_index], "discard")
         self.go_next_image()
 
+    def decide_cluster(self, decision):
+        """Applies `decision` to the current image and all its queued near-duplicates."""
+        if not self.image_paths or self.current_index >= len(self.image_paths): return
+        members = self.near_duplicates(self.image_paths[self.current_index])
+        # Take the group out of the queue first, so the next image shown is not one of them
+        if members:
+            self._remove_from_queue(set(members))
+        {"keep": self.keep_image, "discard": self.discard_image, "modify": self.modify_image}[decision]()
+        for path in members:
+            if decision == "discard":
+                self.record_decision(path, "discard")
+            else:
+                self.submit_job(path, decision, advance=False)
+        if members:
+            print(f"{decision.capitalize()}: {len(members) + 1} near-duplicate images")
+
+    def record_decision(self, img_path, decision, job_id=None):
+        self._decided_paths.add(img_path)
+        if self._session:
+            self._session.record_decision(img_path, decision, job_id)
+
     def modify_image(self, event=None):
         if not self.image_paths or self.current_index >= len(self.image_paths): return
-        img_path = self.image_paths[self.current_index]
-        self.go_next_image()
-        self.executor.submit(self._process_image_task, img_path, "modify")
+        self.submit_job(self.image_paths[self.current_index], "modify")
 
     def go_next_image(self):
         self.current_index += 1
@@ -406,6 +4842,13 @@ class ImageReviewer(TkinterDnD.Tk):
 
     def display_end_of_review(self):
         """Show a message when all images are reviewed."""
+        self.cluster_label.config(text="")
+        self.processed_label.config(text="")
+        if self._scanner and not self._scanner.done:
+            self.image_label.config(text=f"\n\nScanning folder... ({self._scanner.found} images found)\n\n", image="", bg="grey90")
+            self.image_label.image = None
+            self.current_img = None
+            return
         self.image_label.config(text="\n\nNo more images to review.\nDrop a new folder to continue.\n\n", image=None, bg="grey90")
         self.image_label.image = None
         self.current_img = None
@@ -441,7 +4884,473 @@ class ImageReviewer(TkinterDnD.Tk):
             return self.config_data["central_folder_path"]
         return self.current_folder
 
+# ---------------- Review throughput simulator ----------------
+SIM_KEY_ACTIONS = {"k": "keep_image", "d": "discard_image", "u": "modify_image"}
+SIM_DISPLAY_SIZE = (1180, 700)  # Image area of the default 1200x1000 window
+SIM_QUEUED_AFTER = 0.005  # A key that waits longer than this for the event loop counts as queued
+
+class _SimVar:
+    def __init__(self, master=None, value=None, name=None):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+class _SimWidget:
+    """Accepts any widget call. The simulated image area has SIM_DISPLAY_SIZE."""
+    def __init__(self, *args, **kwargs):
+        self._options = dict(kwargs)
+
+    def config(self, **kwargs):
+        self._options.update(kwargs)
+
+    configure = config
+
+    def cget(self, key):
+        return self._options.get(key)
+
+    def winfo_width(self):
+        return SIM_DISPLAY_SIZE[0]
+
+    def winfo_height(self):
+        return SIM_DISPLAY_SIZE[1]
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+class _SimRoot(_SimWidget):
+    """
+    Stand-in for the Tk root window: after() timers run from update(), in
+    order and only when the caller gives the event loop time, like Tk does.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._timers = []
+        self._timer_seq = 0
+        self._cancelled = set()
+
+    def after(self, ms, func=None, *args):
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (time.perf_counter() + ms / 1000, self._timer_seq, func, args))
+        return self._timer_seq
+
+    def after_cancel(self, timer_id):
+        self._cancelled.add(timer_id)
+
+    def update(self):
+        now = time.perf_counter()
+        while self._timers and self._timers[0][0] <= now:
+            _, timer_id, func, args = heapq.heappop(self._timers)
+            if timer_id in self._cancelled:
+                self._cancelled.discard(timer_id)
+            elif func is not None:
+                func(*args)
+
+    def title(self, text=None):
+        if text is None:
+            return self._options.get("title", "")
+        self._options["title"] = text
+
+    def update_idletasks(self):
+        pass
+
+    def destroy(self):
+        self._timers.clear()
+
+class _SimPhotoImage:
+    """Copies the pixels once, as handing an image to Tk does."""
+    def __init__(self, image=None, **kwargs):
+        self._data = image.tobytes() if image is not None else b""
+
+def _sim_module(name, **attributes):
+    """A module whose unknown attributes are widgets, variables or constants."""
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+
+    def __getattr__(attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        if attr.isupper():
+            return attr.lower()
+        return _SimVar if attr.endswith("Var") else _SimWidget
+
+    module.__getattr__ = __getattr__
+    return module
+
+def load_headless_reviewer_module():
+    """
+    Loads a second copy of this module against stand-ins for tkinter and
+    ImageTk, so the real ImageReviewer code can run without
+    a display. The copy has its own globals; nothing here is affected.
+    """
+    import PIL
+    tk_module = _sim_module("tkinter", TclError=type("TclError", (Exception,), {}), Tk=_SimRoot)
+    for sub in ("filedialog", "messagebox", "ttk"):
+        setattr(tk_module, sub, _sim_module(f"tkinter.{sub}"))
+    stubs = {
+        "tkinter": tk_module,
+        "tkinter.filedialog": tk_module.filedialog,
+        "tkinter.messagebox": tk_module.messagebox,
+        "tkinter.ttk": tk_module.ttk,
+        "PIL.ImageTk": _sim_module("PIL.ImageTk", PhotoImage=_SimPhotoImage),
+    }
+    saved_modules = {name: sys.modules.get(name) for name in stubs}
+    saved_image_tk = PIL.__dict__.get("ImageTk")
+    sys.modules.update(stubs)
+    PIL.ImageTk = stubs["PIL.ImageTk"]
+    try:
+        spec = importlib.util.spec_from_file_location("image_review_headless", os.path.abspath(__file__))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.ImageReviewer._enable_drag_and_drop = lambda self: None  # Nothing to drop onto
+    finally:
+        for name, previous in saved_modules.items():
+            if previous is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = previous
+        if saved_image_tk is None:
+            del PIL.ImageTk
+        else:
+            PIL.ImageTk = saved_image_tk
+    return module
+
+def percentile(values, p):
+    """Nearest-rank percentile of `values` (0 if empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def _simulate_run(reviewer_class, folder, keys, rate, real_display, drain_timeout):
+    """Drives one reviewer over `folder` with one key press per image at `rate` keys/s."""
+    app = reviewer_class()
+    handlers = {key: getattr(app, action) for key, action in SIM_KEY_ACTIONS.items()}
+    try:
+        app.load_images(folder)
+        deadline = time.perf_counter() + 60
+        while app.current_img is None and time.perf_counter() < deadline:
+            app.update()
+            time.sleep(0.005)
+        if app.current_img is None:
+            raise RuntimeError(f"No image was displayed from {folder}")
+
+        presses = len(app.image_paths)
+        start = time.perf_counter() + 0.5  # Let the first preview settle
+        intended = [start + i / rate for i in range(presses)]
+        latencies, queue_depths = [], []
+        queued = ignored = handled = 0
+        stop_at = intended[-1] + drain_timeout
+        while handled < presses and time.perf_counter() < stop_at:
+            app.update()
+            now = time.perf_counter()
+            if now < intended[handled]:
+                time.sleep(min(intended[handled] - now, 0.002))
+                continue
+            if now - intended[handled] > SIM_QUEUED_AFTER:
+                queued += 1
+            if app.current_index >= len(app.image_paths):
+                ignored += 1  # Nothing left to review; the key does nothing
+            handlers[keys[handled % len(keys)]]()
+            if real_display:
+                app.update_idletasks()  # Paint the new image before stopping the clock
+            latencies.append((time.perf_counter() - intended[handled]) * 1000)
+            queue_depths.append(app.executor._work_queue.qsize())
+            handled += 1
+        return {
+            "rate": rate,
+            "presses": presses,
+            "handled": handled,
+            "queued": queued,
+            "dropped": presses - handled,
+            "ignored": ignored,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies, default=0.0),
+            "mean_queue_depth": sum(queue_depths) / len(queue_depths) if queue_depths else 0.0,
+            "max_queue_depth": max(queue_depths, default=0),
+        }
+    finally:
+        # Queued keep/modify jobs are not part of the measurement
+        app.executor.shutdown(wait=True, cancel_futures=True)
+        app.on_closing()
+
+def simulate_review(keys="kkdu", rates=(2, 5, 10), images=40, megapixels=12, real_display=False,
+                    drain_timeout=5.0, progress=print):
+    """
+    Measures how fast an operator can move through a folder: drives the
+    ImageReviewer with the scripted `keys` (k = keep, d = discard,
+    u = modify, repeated) at every rate in `rates` keys/s over a synthetic
+    folder of `images` JPEGs. With `real_display` the real Tk window is used
+    (e.g. under xvfb-run); otherwise a stand-in without a display.
+
+    Returns one result per rate with keypress-to-display latency
+    percentiles, queued keys (the event loop was still busy), dropped keys
+    (not handled within `drain_timeout` s after the script ended) and the
+    depth of the background job queue.
+    """
+    unknown = set(keys) - set(SIM_KEY_ACTIONS)
+    if not keys or unknown:
+        raise ValueError(f"Keys must be made of {', '.join(SIM_KEY_ACTIONS)}; got {keys!r}")
+    if real_display:
+        if GUI_IMPORT_ERROR is not None:
+            raise RuntimeError(f"The real window needs tkinter: {GUI_IMPORT_ERROR}")
+        reviewer_class = ImageReviewer
+    else:
+        reviewer_class = load_headless_reviewer_module().ImageReviewer
+
+    config = load_config()
+    # Every run's folder holds copies of one image: nothing may skip or group them
+    config.update(skip_processed_sources=False, near_duplicate_hashing=False, shared_review=False, spool_dir="")
+    previous_cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="image_review_sim_") as work_dir:
+        sample = os.path.join(work_dir, "sample.jpg")
+        synthetic_image(megapixels, 'RGB').save(sample, "JPEG", quality=90)
+        config["use_central_folder"] = False
+        try:
+            for n, rate in enumerate(rates):
+                # Every rate starts in its own working directory, where the reviewer keeps
+                # its config and job journal, so jobs cancelled at the end of one run are
+                # not replayed during the next. Its folder is undecided, too.
+                run_dir = os.path.join(work_dir, f"run_{n}")
+                folder = os.path.join(run_dir, "images")
+                os.makedirs(folder)
+                os.chdir(run_dir)
+                save_config(config)
+                for i in range(images):
+                    shutil.copyfile(sample, os.path.join(folder, f"IMG_{i:04d}.jpg"))
+                if progress:
+                    progress(f"Simulating {rate:g} keys/s over {images} images...")
+                results.append(_simulate_run(reviewer_class, folder, keys, rate, real_display, drain_timeout))
+        finally:
+            os.chdir(previous_cwd)
+    return results
+
+def format_simulation(results):
+    lines = [f"{'keys/s':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+             f"{'queued':>7} {'dropped':>8} {'ignored':>8} {'jobs q avg':>10} {'jobs q max':>10}"]
+    for r in results:
+        lines.append(f"{r['rate']:>6g} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+                     f"{r['max_ms']:>8.1f} {r['queued']:>7} {r['dropped']:>8} {r['ignored']:>8} "
+                     f"{r['mean_queue_depth']:>10.1f} {r['max_queue_depth']:>10}")
+    return "\n".join(lines)
+
 def main():
+    parser = argparse.ArgumentParser(description="Image Review Helper")
+    parser.add_argument("--batch", metavar="FOLDER",
+                        help="process every image in FOLDER without the GUI")
+    parser.add_argument("--subfolder", default="keep", choices=["keep", "modify"],
+                        help="output subfolder for --batch (default: keep)")
+    parser.add_argument("--output", metavar="DIR", help="base output folder for --batch (default: FOLDER)")
+    parser.add_argument("--quality", type=int, help="JPEG quality for --batch (default: from config)")
+    parser.add_argument("--no-effects", action="store_true", help="skip realism effects in --batch")
+    parser.add_argument("--depth", type=int, default=0, help="subfolder depth to include in --batch")
+    parser.add_argument("--io-concurrency", type=int, default=64,
+                        help="file operations in flight at once for --batch (default: 64)")
+    parser.add_argument("--skip-processed", action="store_true",
+                        help=f"leave out sources whose content was processed before (see {PROCESSED_INDEX_FILE})")
+    parser.add_argument("--encoder", choices=list(ENCODER_PROFILES), help="encoder profile for --batch")
+    parser.add_argument("--downscale", action="store_true",
+                        help="scale --batch outputs down to the phone model's native resolution")
+    parser.add_argument("--frame", choices=FRAME_SELECTIONS,
+                        help="frame of animated inputs to process in --batch")
+    parser.add_argument("--bench-ingest", action="store_true",
+                        help="time input conversion for every supported input type and exit")
+    parser.add_argument("--bench", action="store_true",
+                        help="benchmark every processing stage on synthetic images and exit; "
+                             "fails if slower than the baseline")
+    parser.add_argument("--bench-sizes", default=",".join(map(str, BENCH_SIZES_MP)),
+                        help="comma-separated megapixel sizes for --bench (default: 1,12,48,100)")
+    parser.add_argument("--bench-repeats", type=int, default=3,
+                        help="runs per stage for --bench; the median is compared with the baseline (default: 3)")
+    parser.add_argument("--bench-baseline", default=BENCH_BASELINE_FILE,
+                        help=f"baseline JSON file for --bench (default: {BENCH_BASELINE_FILE})")
+    parser.add_argument("--bench-save-baseline", action="store_true",
+                        help="store the --bench results as the new baseline")
+    parser.add_argument("--bench-threshold", type=float, default=0.2,
+                        help="allowed slowdown against the baseline for --bench (default: 0.2 = 20%%)")
+    parser.add_argument("--simulate-review", action="store_true",
+                        help="measure keypress-to-display latency of the review window on a synthetic folder and exit")
+    parser.add_argument("--sim-keys", default="kkdu",
+                        help="key script for --simulate-review, repeated: k = keep, d = discard, u = modify")
+    parser.add_argument("--sim-rates", default="2,5,10", help="comma-separated keys per second to simulate")
+    parser.add_argument("--sim-images", type=int, default=40, help="images in the synthetic folder")
+    parser.add_argument("--sim-mp", type=float, default=12, help="megapixels of the synthetic images")
+    parser.add_argument("--sim-display", action="store_true",
+                        help="drive the real Tk window (needs a display, e.g. xvfb-run) instead of a stand-in")
+    parser.add_argument("--bench-startup", type=int, nargs="?", const=5, metavar="RUNS",
+                        help="measure time to first window and first image over RUNS fresh starts (default: 5) "
+                             "and exit; with --sim-display the real window is used")
+    parser.add_argument("--startup-probe", metavar="FOLDER", help=argparse.SUPPRESS)
+    parser.add_argument("--bench-orientation", action="store_true",
+                        help="time EXIF orientation handling in preview and processing and exit")
+    parser.add_argument("--target-kb", type=int, help="maximum output size in KB for --batch (0 = off)")
+    parser.add_argument("--calibrate", metavar="FOLDER",
+                        help="measure encode time and size of every encoder profile on FOLDER and exit")
+    parser.add_argument("--near-duplicates", metavar="FOLDER",
+                        help="list groups of near-identical images in FOLDER (with --depth) and exit")
+    parser.add_argument("--metrics", metavar="FILE", help="append per-job stage timings of --batch as JSON lines")
+    parser.add_argument("--metrics-prom-file", metavar="FILE",
+                        help="keep Prometheus-format totals of --batch in FILE")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus-format totals of --batch on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help=f"profile --batch and write the results to the profile_dir folder "
+                             f"(also: {PROFILE_ENV}=<mode>[:<seconds>])")
+    parser.add_argument("--profile-seconds", type=float, default=0,
+                        help="stop profiling after this many seconds (default: whole run)")
+    parser.add_argument("--spool-worker", metavar="SPOOL_DIR",
+                        help="run as a headless worker for the jobs reviewers put into SPOOL_DIR (spool_dir)")
+    parser.add_argument("--spool-threads", type=int, help="jobs a --spool-worker runs at once (default: CPU count)")
+    parser.add_argument("--exit-when-idle", action="store_true",
+                        help="stop the --spool-worker once no job is pending or running")
+    parser.add_argument("--inject-latency-ms", type=float, default=0.0,
+                        help="add artificial latency to every file operation (testing)")
+    args = parser.parse_args()
+
+    if args.bench_ingest:
+        print(f"{'Input':<22} {'ingest ms':>10} {'convert ms':>11}")
+        for name, (ingest_ms, convert_ms) in benchmark_ingestion().items():
+            print(f"{name:<22} {ingest_ms:>10.1f} {convert_ms:>11.1f}")
+        return
+
+    if args.bench:
+        sizes = [float(size) if "." in size else int(size) for size in args.bench_sizes.split(",")]
+        results = benchmark_pipeline(sizes, repeats=args.bench_repeats)
+        print(format_benchmark(results))
+        if args.bench_save_baseline:
+            baseline = {"meta": results["meta"], "cases": {}}
+            if os.path.exists(args.bench_baseline):
+                with open(args.bench_baseline) as f:
+                    baseline["cases"] = json.load(f).get("cases", {})
+            baseline["cases"].update(results["cases"])  # Keep cases this run did not cover
+            with open(args.bench_baseline, "w") as f:
+                json.dump(baseline, f, indent=2)
+            print(f"Baseline saved to {args.bench_baseline}")
+            return
+        if not os.path.exists(args.bench_baseline):
+            print(f"No baseline at {args.bench_baseline}; run with --bench-save-baseline to create one")
+            return
+        with open(args.bench_baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.bench_threshold)
+        if regressions:
+            # Measure the slower cases again, so a burst of load on the machine is not reported
+            slower = {name for name in results["cases"] if any(line.startswith(f"{name} ") for line in regressions)}
+            print(f"Measuring {len(slower)} slower case(s) again to confirm...")
+            again = benchmark_pipeline(sizes, repeats=2 * args.bench_repeats, only=slower)
+            for name, case in again["cases"].items():
+                results["cases"][name] = merge_benchmark_cases(results["cases"][name], case)
+            regressions = compare_to_baseline(results, baseline, args.bench_threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.bench_threshold:.0%} of {args.bench_baseline}")
+        return
+
+    if args.simulate_review:
+        rates = [float(rate) for rate in args.sim_rates.split(",")]
+        results = simulate_review(args.sim_keys, rates, args.sim_images, args.sim_mp, args.sim_display)
+        print(format_simulation(results))
+        return
+
+    if args.startup_probe:
+        _startup_probe(args.startup_probe, args.sim_display)
+        return
+
+    if args.bench_startup:
+        timings = benchmark_startup(args.bench_startup, args.sim_display)
+        print(f"Median of {args.bench_startup} starts (ms from process start):")
+        print(f"  module imported   {timings['imported']:>8.0f}")
+        print(f"  window created    {timings['window']:>8.0f}")
+        print(f"  first image shown {timings['image']:>8.0f}")
+        print(f"  background warm-up (numpy, piexif, effects) {timings['warm_up']:.0f} ms")
+        return
+
+    if args.bench_orientation:
+        for name, ms in benchmark_orientation().items():
+            print(f"{name:<36} {ms:>8.1f} ms")
+        return
+
+    if args.calibrate:
+        config = load_config()
+        quality = args.quality if args.quality is not None else config["jpeg_quality"]
+        paths = list(iter_image_files(args.calibrate, args.depth))
+        if not paths:
+            raise SystemExit(f"No images found in {args.calibrate}")
+        print(f"Encoder profiles at quality {quality} ({min(20, len(paths))} sample images):")
+        print(format_calibration(calibrate_encoder_profiles(paths, quality)))
+        return
+
+    if args.near_duplicates:
+        config = load_config()
+        started = time.perf_counter()
+        clusters, hashed = find_near_duplicates(args.near_duplicates, args.depth, config["near_duplicate_distance"])
+        for members in clusters:
+            print(f"{len(members)} images:")
+            for path in members:
+                print(f"  {path}")
+        print(f"{len(clusters)} group(s) with {sum(map(len, clusters))} images; "
+              f"{hashed} file(s) hashed in {time.perf_counter() - started:.1f} s, the rest from {FOLDER_DB_NAME}")
+        return
+
+    if args.spool_worker:
+        config = load_config()
+        for key, value in (("metrics_file", args.metrics), ("metrics_prometheus_file", args.metrics_prom_file),
+                           ("metrics_prometheus_port", args.metrics_port)):
+            if value is not None:
+                config[key] = value
+        configure_metrics(config)
+        _, failed = run_spool_worker(args.spool_worker, args.spool_threads, args.exit_when_idle)
+        raise SystemExit(1 if failed else 0)
+
+    if args.batch:
+        config = load_config()
+        settings = {
+            "quality": args.quality if args.quality is not None else config["jpeg_quality"],
+            "apply_effects": config["apply_realism_effects"] and not args.no_effects,
+            "encoder_profile": args.encoder or config["encoder_profile"],
+            "target_size_kb": args.target_kb if args.target_kb is not None else config["target_size_kb"],
+            "downscale_to_device": args.downscale or config["downscale_to_device"],
+            "frame_selection": args.frame or config["frame_selection"],
+        }
+        for key, value in (("metrics_file", args.metrics), ("metrics_prometheus_file", args.metrics_prom_file),
+                           ("metrics_prometheus_port", args.metrics_port)):
+            if value is not None:
+                config[key] = value
+        configure_metrics(config)
+        requested = (args.profile, args.profile_seconds) if args.profile else profile_from_env()
+        stop_timer = None
+        if requested:
+            # Worker tasks and stack samples only: the main thread just runs the event loop
+            profiler.start(requested[0], profile_caller=False)
+            if requested[1]:
+                stop_timer = threading.Timer(requested[1], lambda: print(
+                    f"Profile written to {profiler.stop(config['profile_dir'])}"))
+                stop_timer.daemon = True
+                stop_timer.start()
+        _, failed = run_batch(args.batch, args.subfolder, args.output, settings, args.depth,
+                              args.io_concurrency, args.inject_latency_ms / 1000.0,
+                              skip_processed=args.skip_processed)
+        if stop_timer is not None:
+            stop_timer.cancel()
+            stop_timer.join()
+        if profiler.active:
+            print(f"Profile written to {profiler.stop(config['profile_dir'])}")
+        if size_model.images:
+            print(f"Target size mode: {size_model.encodes_per_image():.2f} encodes per image")
+        raise SystemExit(1 if failed else 0)
+
+    if GUI_IMPORT_ERROR is not None:
+        raise SystemExit(f"The review window needs tkinter: {GUI_IMPORT_ERROR}")
     app = ImageReviewer()
     app.mainloop()
 